@@ -0,0 +1,2 @@
+pip install uv
+uv run --no-dev python run.py --profile-startup --startup-budget 3
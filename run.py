@@ -1,7 +1,15 @@
-import notch
+import sys
 
-import wormgas.wormgas
+import notch
 
 notch.configure()
 
-wormgas.wormgas.main()
+if "--profile-startup" in sys.argv:
+    import wormgas.profiling
+
+    args = [a for a in sys.argv[1:] if a != "--profile-startup"]
+    sys.exit(wormgas.profiling.main(args))
+else:
+    import wormgas.wormgas
+
+    wormgas.wormgas.main()
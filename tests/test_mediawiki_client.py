@@ -0,0 +1,90 @@
+import types
+import unittest
+
+import aiohttp
+import aiohttp.test_utils
+import aiohttp.web
+
+from wormgas.cogs.wiki import WikiCog
+from wormgas.mediawiki_client import MediaWikiClient, PageNotFoundError
+
+SUMMARIES = {
+    "Rainwave": {
+        "type": "standard",
+        "title": "Rainwave",
+        "extract": "Rainwave is an internet radio station.",
+        "content_urls": {"desktop": {"page": "https://en.wikipedia.org/wiki/Rainwave"}},
+    },
+    "Mercury": {"type": "disambiguation", "title": "Mercury"},
+}
+
+LINKS = {"Mercury": ["Mercury (element)", "Mercury (planet)"]}
+
+
+async def page_summary(request: aiohttp.web.Request) -> aiohttp.web.Response:
+    title = request.match_info["title"].replace("_", " ")
+    if title == "Broken":
+        return aiohttp.web.Response(status=500)
+    if title not in SUMMARIES:
+        return aiohttp.web.json_response({"title": "Not found."}, status=404)
+    return aiohttp.web.json_response(SUMMARIES[title])
+
+
+async def action_api(request: aiohttp.web.Request) -> aiohttp.web.Response:
+    title = request.query["titles"]
+    links = [{"ns": 0, "title": link} for link in LINKS.get(title, [])]
+    pages = [{"ns": 0, "title": title, "links": links}]
+    return aiohttp.web.json_response({"query": {"pages": pages}})
+
+
+class MediaWikiClientTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        app = aiohttp.web.Application()
+        app.router.add_get("/api/rest_v1/page/summary/{title}", page_summary)
+        app.router.add_get("/w/api.php", action_api)
+        self.server = aiohttp.test_utils.TestServer(app)
+        await self.server.start_server()
+        self.session = aiohttp.ClientSession()
+        self.client = MediaWikiClient(self.session, str(self.server.make_url("/")))
+
+    async def asyncTearDown(self) -> None:
+        await self.session.close()
+        await self.server.close()
+
+    async def test_page_summary(self) -> None:
+        d = await self.client.page_summary("Rainwave")
+        self.assertEqual(d["title"], "Rainwave")
+        self.assertEqual(self.client.requests, 1)
+
+    async def test_page_not_found(self) -> None:
+        with self.assertRaises(PageNotFoundError):
+            await self.client.page_summary("No such page")
+        self.assertEqual(self.client.requests, 1)
+
+    async def test_disambiguation(self) -> None:
+        d = await self.client.page_summary("Mercury")
+        self.assertEqual(d["type"], "disambiguation")
+        links = await self.client.page_links(d["title"])
+        self.assertEqual(links, LINKS["Mercury"])
+        self.assertEqual(self.client.requests, 2)
+
+    async def test_wiki_command_caches_lookups(self) -> None:
+        sent = []
+
+        async def send(message: str) -> None:
+            sent.append(message)
+
+        ctx = types.SimpleNamespace(send=send, author=types.SimpleNamespace(send=send))
+        cog = WikiCog(types.SimpleNamespace(session=self.session))
+        cog.client = self.client
+        for search_terms in ("Rainwave", " rainwave ", "Mercury", "mercury"):
+            await cog.wiki.callback(cog, ctx, search_terms=search_terms)
+        self.assertEqual(self.client.requests, 3)
+        self.assertEqual(len(sent), 6)
+
+        await cog.wiki.callback(cog, ctx, search_terms="Broken")
+        self.assertEqual(sent[-1], "There was a problem.")
+
+
+if __name__ == "__main__":
+    unittest.main()
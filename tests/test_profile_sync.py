@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+
+from wormgas.cogs.rainwave import ProfileSync
+
+
+class ProfileSyncTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.sends: list[tuple[int, str]] = []
+        self.failing: set[str] = set()
+        self.sync = ProfileSync("nickname", self.send, delay=0.01, max_wait=0.1)
+
+    async def asyncTearDown(self) -> None:
+        await self.sync.stop()
+
+    async def send(self, discord_user_id: int, value: str) -> dict:
+        self.sends.append((discord_user_id, value))
+        await asyncio.sleep(0.05)
+        if value in self.failing:
+            raise RuntimeError(f"Could not send {value}")
+        return {"success": True}
+
+    async def test_sends_only_the_final_value(self) -> None:
+        self.sync.put(1, "A")
+        self.sync.put(1, "B")
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.sends, [(1, "B")])
+
+    async def test_skips_a_value_that_was_already_sent(self) -> None:
+        self.sync.put(1, "A")
+        await asyncio.sleep(0.1)
+        self.sync.put(1, "A")
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.sends, [(1, "A")])
+
+    async def test_revert_while_sending(self) -> None:
+        self.sync.put(1, "A")
+        await asyncio.sleep(0.1)
+        self.sync.put(1, "B")
+        await asyncio.sleep(0.03)
+        self.assertEqual(self.sends[-1], (1, "B"))
+        self.sync.put(1, "A")
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.sends, [(1, "A"), (1, "B"), (1, "A")])
+        self.assertEqual(self.sync.sent[1], "A")
+
+    async def test_does_not_retry_a_replaced_value(self) -> None:
+        self.failing.add("A")
+        self.sync.put(1, "A")
+        await asyncio.sleep(0.03)
+        self.sync.put(1, "B")
+        await asyncio.sleep(0.15)
+        self.assertEqual(self.sends, [(1, "A"), (1, "B")])
+        self.assertEqual(self.sync.retries, {})
+        self.assertEqual(self.sync.sent[1], "B")
+
+    async def test_retries_a_failed_value(self) -> None:
+        self.failing.add("A")
+        self.sync.put(1, "A")
+        await asyncio.sleep(0.1)
+        self.assertIn(1, self.sync.retries)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import datetime
+import inspect
+import unittest
+
+from wormgas.models import Database
+
+NOW = datetime.datetime.now(tz=datetime.UTC)
+
+# Every Database coroutine that runs SQL, with arguments to call it with
+CALLS = [
+    (
+        "command_log_insert_many",
+        [
+            {
+                "occurred_at": NOW.isoformat(),
+                "discord_user_id": 1,
+                "command": "np",
+                "message": "!np",
+            }
+        ],
+    ),
+    ("command_log_archive", NOW),
+    ("command_stats_daily", "np", NOW),
+    ("command_stats_list",),
+    ("command_stats_list", NOW),
+    ("config_set", "key", "value"),
+    ("config_get", "key"),
+    ("config_list_keys",),
+    ("config_list_prefix", "discord:roles:notify:"),
+    ("config_delete", "key"),
+    ("events_insert", 1),
+    ("events_get", 1),
+    ("events_update_notification_sent", 1),
+    ("events_list_notified",),
+    ("perk_sync_insert_many", [1, 2]),
+    ("perk_sync_list",),
+    ("rps_record_game", 1, "rock", "wins"),
+    ("rps_get", 1),
+    ("rps_rank", 1),
+    ("rps_top",),
+    (
+        "rps_set",
+        {
+            "user_id": 1,
+            "rock": 1,
+            "paper": 0,
+            "scissors": 0,
+            "wins": 1,
+            "draws": 0,
+            "losses": 0,
+            "reset_code": None,
+        },
+    ),
+    ("rps_delete", 1),
+    ("rw_api_keys_set", 1, "key"),
+    ("rw_api_keys_get", 1),
+    ("rw_api_keys_delete", 1),
+    ("topic_control_insert", 1),
+    ("topic_control_list",),
+    ("topic_control_delete", 1),
+    ("watch_words_insert", 1, 2, "text"),
+    ("watch_words_list", 1),
+]
+
+# These load a whole table once at startup, so a scan is expected
+FULL_TABLE_LOADS = {"events_list_notified", "perk_sync_list", "topic_control_list"}
+
+
+class QueryPlanTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.db = Database(":memory:")
+        self.db.migrate()
+        self.statements: list[str] = []
+        self.db.call(self.db.cnx.set_trace_callback, self.statements.append)
+
+    def tearDown(self) -> None:
+        self.db.close()
+
+    def query_plan(self, sql: str) -> list[str]:
+        return [
+            r["detail"] for r in self.db.call(self.db.q, f"explain query plan {sql}")
+        ]
+
+    async def test_queries_use_indexes(self) -> None:
+        for name, *args in CALLS:
+            self.statements.clear()
+            await getattr(self.db, name)(*args)
+            statements = [
+                s for s in self.statements if s not in ("begin", "commit", "rollback")
+            ]
+            self.assertTrue(statements, f"{name} ran no SQL")
+            if name in FULL_TABLE_LOADS:
+                continue
+            for sql in statements:
+                for detail in self.query_plan(sql):
+                    with self.subTest(method=name, plan=detail):
+                        self.assertFalse(
+                            detail.startswith("SCAN ") and " USING " not in detail,
+                            f"{name} scans a table:\n{sql}",
+                        )
+
+    def test_every_method_is_checked(self) -> None:
+        checked = {name for name, *_ in CALLS}
+        methods = {
+            name
+            for name, value in vars(Database).items()
+            if not name.startswith("_")
+            and name not in ("ab", "aq", "aq_one", "aq_val", "atx", "au", "run")
+            and inspect.iscoroutinefunction(value)
+        }
+        self.assertEqual(methods - checked, set())
+
+
+if __name__ == "__main__":
+    unittest.main()
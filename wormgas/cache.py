@@ -0,0 +1,102 @@
+import asyncio
+import collections
+import logging
+import time
+import typing
+
+log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class AsyncCache:
+    """An LRU cache whose entries expire after a per-entry TTL.
+
+    get_or_fetch() coalesces concurrent misses for the same key, so only one fetch
+    is in flight per key at a time. Expired entries stay available through
+    get_stale() until they are evicted."""
+
+    def __init__(self, max_size: int = 128) -> None:
+        self.max_size = max_size
+        self.entries: collections.OrderedDict[typing.Hashable, tuple[float, object]] = (
+            collections.OrderedDict()
+        )
+        self.in_flight: dict[typing.Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses + self.coalesced
+        if lookups == 0:
+            return 0.0
+        return (self.hits + self.coalesced) / lookups
+
+    def get(self, key: typing.Hashable, default: object = None) -> object:
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def get_stale(self, key: typing.Hashable, default: object = None) -> object:
+        """Return the value for key even if it has expired, as long as it has not
+        been evicted"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def set(self, key: typing.Hashable, value: object, ttl: float) -> None:
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key: typing.Hashable) -> None:
+        self.entries.pop(key, None)
+
+    async def get_or_fetch(
+        self,
+        key: typing.Hashable,
+        fetch: typing.Callable[[], typing.Awaitable],
+        ttl: float | typing.Callable[[typing.Any], float],
+    ) -> typing.Any:  # noqa: ANN401
+        """Return the cached value for key, or await fetch() and cache the result.
+
+        ttl is either a number of seconds or a function that computes the number of
+        seconds from the fetched value."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        task = self.in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key, fetch, ttl))
+            self.in_flight[key] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _fetch(
+        self,
+        key: typing.Hashable,
+        fetch: typing.Callable[[], typing.Awaitable],
+        ttl: float | typing.Callable[[typing.Any], float],
+    ) -> typing.Any:  # noqa: ANN401
+        try:
+            value = await fetch()
+            if callable(ttl):
+                ttl = ttl(value)
+            self.set(key, value, ttl)
+            return value
+        finally:
+            del self.in_flight[key]
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.entries)} entries, {self.hits} hits, {self.misses} misses, "
+            f"{self.coalesced} coalesced ({self.hit_rate:.0%} hit rate)"
+        )
@@ -1,3 +1,5 @@
+import asyncio
+import concurrent.futures
 import logging
 import os
 import pathlib
@@ -46,8 +48,41 @@ class ChatCog(discord.ext.commands.Cog):
 
     def __init__(self, bot: wormgas.wormgas.Wormgas) -> None:
         self.bot = bot
-        brain_file = pathlib.Path(os.getenv("BRAIN_FILE", "/etc/wormgas/_brain.sqlite"))
-        self.brain = wormgas.cogs.cobe.brain.Brain(str(brain_file))
+        self.brain_file = pathlib.Path(
+            os.getenv("BRAIN_FILE", "/etc/wormgas/_brain.sqlite")
+        )
+        self.brain: wormgas.cogs.cobe.brain.Brain | None = None
+        self.brain_task: asyncio.Task | None = None
+        # The brain's SQLite connection may only be used on the thread that opened
+        # it, so one thread opens the brain and runs every call to it
+        self.brain_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="brain"
+        )
+
+    def _open_brain(self) -> wormgas.cogs.cobe.brain.Brain:
+        start = time.perf_counter()
+        brain = wormgas.cogs.cobe.brain.Brain(str(self.brain_file))
+        log.info(f"Opened brain in {time.perf_counter() - start:.3f}s")
+        return brain
+
+    async def get_brain(self) -> wormgas.cogs.cobe.brain.Brain:
+        """Open the brain the first time it is needed"""
+        if self.brain is None:
+            if self.brain_task is None:
+                loop = asyncio.get_running_loop()
+                self.brain_task = asyncio.ensure_future(
+                    loop.run_in_executor(self.brain_executor, self._open_brain)
+                )
+            self.brain = await asyncio.shield(self.brain_task)
+        return self.brain
+
+    @discord.ext.commands.Cog.listener()
+    async def on_ready(self) -> None:
+        # Warm up the brain once the bot is connected instead of delaying startup
+        await self.get_brain()
+
+    async def cog_unload(self) -> None:
+        self.brain_executor.shutdown(wait=False)
 
     @discord.ext.commands.command()
     async def mention(
@@ -58,7 +93,9 @@ class ChatCog(discord.ext.commands.Cog):
         watch_text: str,
     ) -> None:
         normalized_watch_text = watch_text.lower()
-        self.bot.db.watch_words_insert(channel.id, ctx.author.id, normalized_watch_text)
+        await self.bot.db.watch_words_insert(
+            channel.id, ctx.author.id, normalized_watch_text
+        )
         await ctx.author.send(
             f"Okay, I will ping you whenever I see a message in {channel} "
             f"that contains {normalized_watch_text!r}"
@@ -74,7 +111,7 @@ class ChatCog(discord.ext.commands.Cog):
             log.debug("Ignoring message from myself")
             return
 
-        watch_words = self.bot.db.watch_words_list(message.channel.id)
+        watch_words = await self.bot.db.watch_words_list(message.channel.id)
         pinged_users = message.mentions
         for ww in watch_words:
             user = self.bot.get_user(ww["discord_user_id"])
@@ -111,7 +148,6 @@ class ChatCog(discord.ext.commands.Cog):
         response = await self.reply(text)
 
         # Always respond to direct messages
-        now = int(time.time())
         if not message.guild:
             await message.author.send(response)
             return
@@ -120,16 +156,12 @@ class ChatCog(discord.ext.commands.Cog):
         if self.bot.user.id not in [u.id for u in message.mentions]:
             return
 
-        last = int(
-            self.bot.db.config_get(f"chat:last_time_respond:{message.channel.id}") or 0
-        )
-        wait = int(self.bot.db.config_get("chat:wait_respond") or 0)
-        if last < now - wait:
+        wait = int(await self.bot.db.config_get("chat:wait_respond") or 0)
+        remaining = self.bot.cooldowns.acquire("chat", message.channel.id, wait)
+        if remaining == 0:
             await message.channel.send(f"{message.author.mention}: {response}")
-            self.bot.db.config_set(f"chat:last_time_respond:{message.channel.id}", now)
         else:
             await message.author.send(response)
-            remaining = last + wait - now
             m = (
                 f"I am cooling down. I cannot respond in {message.channel.mention} "
                 f"for another {remaining} seconds."
@@ -137,15 +169,24 @@ class ChatCog(discord.ext.commands.Cog):
             await message.author.send(m)
 
     async def reply(self, text: str, learn: bool = True) -> str:
-        ignore = self.bot.db.config_get("chat:ignore")
+        ignore = await self.bot.db.config_get("chat:ignore")
         if ignore is not None and re.search(ignore, text, re.IGNORECASE):
             log.debug(f"Ignoring {text!r}")
             return secrets.choice(self.quotes)
-        to_brain = text
+        brain = await self.get_brain()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.brain_executor, self._learn_and_reply, brain, text, learn
+        )
+
+    @staticmethod
+    def _learn_and_reply(
+        brain: wormgas.cogs.cobe.brain.Brain, text: str, learn: bool
+    ) -> str:
         if learn:
-            log.debug(f"Learning {to_brain!r}")
-            self.brain.learn(to_brain)
-        return self.brain.reply(to_brain)
+            log.debug(f"Learning {text!r}")
+            brain.learn(text)
+        return brain.reply(text)
 
 
 async def setup(bot: wormgas.wormgas.Wormgas) -> None:
@@ -1,6 +1,8 @@
+import datetime
 import logging
 
 import discord.ext
+import discord.ext.tasks
 
 import wormgas.wormgas
 
@@ -10,23 +12,72 @@ log = logging.getLogger(__name__)
 class ConfigCog(discord.ext.commands.Cog, name="Bot configuration"):
     def __init__(self, bot: wormgas.wormgas.Wormgas) -> None:
         self.bot = bot
+        self.archive_command_log.start()
 
     @discord.ext.commands.command(name="command-stats")
-    async def command_stats(self, ctx: discord.ext.commands.Context) -> None:
-        """Show simple statistics about how often commands are used"""
+    async def command_stats(
+        self, ctx: discord.ext.commands.Context, days: int | None = None
+    ) -> None:
+        """Show simple statistics about how often commands are used
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
+        Use "!command-stats [<days>]" to limit the statistics to the last <days> days.
+        """
 
-        results = self.bot.db.command_log_list()
-        embed = discord.Embed(title="Command stats")
+        since = None
+        title = "Command stats"
+        if days is not None:
+            if days < 1:
+                await ctx.send("Use a number of days of at least 1.")
+                return
+            since = datetime.datetime.now(tz=datetime.UTC) - datetime.timedelta(
+                days=days
+            )
+            title = f"Command stats (last {days} days)"
+        results = await self.bot.db.command_stats_list(since)
+        if not results:
+            if days is None:
+                await ctx.send("Nobody has used any commands yet.")
+            else:
+                await ctx.send(f"Nobody used any commands in the last {days} days.")
+            return
+        embed = discord.Embed(title=title)
         commands = "\n".join([r["command"] for r in results])
         embed.add_field(name="Command", value=commands, inline=True)
         invocations = "\n".join([str(r["usage_count"]) for r in results])
         embed.add_field(name="Invocations", value=invocations, inline=True)
         await ctx.send(embed=embed)
 
+    @discord.ext.commands.command(name="command-trend")
+    async def command_trend(
+        self, ctx: discord.ext.commands.Context, command: str, days: int = 7
+    ) -> None:
+        """Show how often a command was used on each of the last few days"""
+
+        since = datetime.datetime.now(tz=datetime.UTC) - datetime.timedelta(days=days)
+        results = await self.bot.db.command_stats_daily(command, since)
+        if not results:
+            await ctx.send(f"Nobody used {command} in the last {days} days.")
+            return
+        embed = discord.Embed(title=f"Command trend for {command}")
+        embed.add_field(
+            name="Day", value="\n".join([r["day"] for r in results]), inline=True
+        )
+        invocations = "\n".join([str(r["usage_count"]) for r in results])
+        embed.add_field(name="Invocations", value=invocations, inline=True)
+        await ctx.send(embed=embed)
+
+    @discord.ext.tasks.loop(hours=24)
+    async def archive_command_log(self) -> None:
+        await self.bot.wait_until_ready()
+        retention_days = await self.bot.db.config_get("command_log:retention_days")
+        if retention_days is None:
+            return
+        cutoff = datetime.datetime.now(tz=datetime.UTC) - datetime.timedelta(
+            days=int(retention_days)
+        )
+        archived = await self.bot.db.command_log_archive(cutoff)
+        log.info(f"Archived {archived} command_log rows older than {cutoff}")
+
     @discord.ext.commands.command(name="set")
     @discord.ext.commands.is_owner()
     async def _set(self, ctx: discord.ext.commands.Context, *tokens: list[str]) -> None:
@@ -37,25 +88,22 @@ class ConfigCog(discord.ext.commands.Cog, name="Bot configuration"):
         Leave off <key> and <value> to see a list of all currently set config keys.
         """
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         if len(tokens) > 1:
             value = " ".join(tokens[1:])
             key = tokens[0]
-            self.bot.db.config_set(key, value)
+            await self.bot.db.config_set(key, value)
+            self.bot.dispatch("config_change", key, value)
             await ctx.author.send(f"{key} = {value}")
         elif len(tokens) > 0:
             key = tokens[0]
-            value = self.bot.db.config_get(key)
+            value = await self.bot.db.config_get(key)
             if value is None:
                 await ctx.author.send(f"{key} is not set.")
             else:
                 await ctx.author.send(f"{key} = {value}")
         else:
-            config_keys = self.bot.db.config_list_keys()
-            max_length = int(self.bot.db.config_get("config:max_length") or 10)
+            config_keys = await self.bot.db.config_list_keys()
+            max_length = int(await self.bot.db.config_get("config:max_length") or 10)
             while len(config_keys) > max_length:
                 config_list = config_keys[:max_length]
                 config_keys[0:max_length] = []
@@ -67,13 +115,13 @@ class ConfigCog(discord.ext.commands.Cog, name="Bot configuration"):
     async def unset(self, ctx: discord.ext.commands.Context, key: str) -> None:
         """Remove a configuration setting."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
-        self.bot.db.config_delete(key)
+        await self.bot.db.config_delete(key)
+        self.bot.dispatch("config_change", key, None)
         await ctx.author.send(f"{key} has been unset.")
 
+    async def cog_unload(self) -> None:
+        self.archive_command_log.cancel()
+
 
 async def setup(bot: wormgas.wormgas.Wormgas) -> None:
     await bot.add_cog(ConfigCog(bot))
@@ -1,17 +1,28 @@
+import asyncio
+import collections
 import datetime
 import enum
+import functools
 import logging
+import secrets
 import time
-import uuid
+import typing
 import zoneinfo
 
 import discord.ext.commands
 import discord.ext.tasks
 
+import wormgas.cache
+import wormgas.concurrency
+import wormgas.rainwave_client
 import wormgas.wormgas
 
 log = logging.getLogger(__name__)
 
+TZ_CHICAGO = zoneinfo.ZoneInfo("America/Chicago")
+TZ_PARIS = zoneinfo.ZoneInfo("Europe/Paris")
+TZ_TORONTO = zoneinfo.ZoneInfo("America/Toronto")
+
 
 def to_bool(argument: str | None) -> bool:
     if argument is None:
@@ -65,6 +76,170 @@ class RainwaveChannel(enum.Enum):
         )
 
 
+class ScheduleUnavailableError(RuntimeError):
+    pass
+
+
+class ScheduleTracker:
+    """Keep the latest schedule info for every Rainwave channel in memory.
+
+    Each channel is refreshed shortly after its current song is due to end, with
+    exponential backoff while the API is failing."""
+
+    min_backoff = 5
+    max_backoff = 300
+    stale_after = 30
+
+    def __init__(self, fetch: typing.Callable[[int], typing.Awaitable[dict]]) -> None:
+        self.fetch = fetch
+        self.info: dict[RainwaveChannel, dict] = {}
+        self.ready = {chan: asyncio.Event() for chan in RainwaveChannel}
+        self.tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        self.tasks = [
+            asyncio.create_task(self._track(chan)) for chan in RainwaveChannel
+        ]
+
+    def stop(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    async def get(self, chan: RainwaveChannel) -> dict:
+        """Return the latest info for chan. If the current song ended a while ago and
+        the schedule could not be refreshed, the result includes "stale": True.
+        Raise ScheduleUnavailableError if chan has never been fetched."""
+        if chan not in self.info:
+            try:
+                await asyncio.wait_for(self.ready[chan].wait(), timeout=15)
+            except TimeoutError:
+                raise ScheduleUnavailableError(
+                    f"No schedule for the {chan.long_name}"
+                ) from None
+        d = self.info[chan]
+        end = d.get("sched_current", {}).get("end", 0)
+        if end + self.stale_after < time.time():
+            return {**d, "stale": True}
+        return d
+
+    @staticmethod
+    def jitter() -> float:
+        return 1 + secrets.randbelow(2000) / 1000
+
+    async def _track(self, chan: RainwaveChannel) -> None:
+        backoff = self.min_backoff
+        while True:
+            try:
+                d = await self.fetch(chan.channel_id)
+            except Exception:
+                log.exception(f"Could not refresh schedule for the {chan.long_name}")
+                await asyncio.sleep(backoff + self.jitter())
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.min_backoff
+            self.info[chan] = d
+            self.ready[chan].set()
+            end = d.get("sched_current", {}).get("end", 0)
+            # If the song should already have ended, wait a moment for the schedule
+            # to advance
+            delay = max(end - time.time(), self.min_backoff) + self.jitter()
+            log.debug(f"Refreshing schedule for the {chan.long_name} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+class ProfileSync:
+    """Send the latest value of a Rainwave profile field for each Discord user.
+
+    Updates for the same user are coalesced for a few seconds and only the final
+    value is sent. Values that Rainwave already has are skipped, and failed updates
+    are retried with exponential backoff until a newer value replaces them."""
+
+    min_backoff = 5
+    max_backoff = 300
+
+    def __init__(
+        self,
+        name: str,
+        send: typing.Callable[[int, str], typing.Awaitable[dict]],
+        delay: float = 10,
+        max_wait: float = 60,
+    ) -> None:
+        self.name = name
+        self.send = send
+        self.queue = wormgas.concurrency.Debouncer(self._flush, delay, max_wait)
+        self.sent: dict[int, str] = {}
+        # The newest value put for each user that has not been sent yet, whether it
+        # is queued, being sent or waiting to retry
+        self.latest: dict[int, str] = {}
+        self.failures: dict[int, int] = {}
+        self.retries: dict[int, asyncio.Task] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self.queue.pending) + len(self.retries)
+
+    def put(self, discord_user_id: int, value: str) -> None:
+        if (retry := self.retries.pop(discord_user_id, None)) is not None:
+            retry.cancel()
+        # A value that is queued, being sent or waiting to retry may still replace
+        # the one Rainwave has, so only skip when there is none
+        if (
+            self.sent.get(discord_user_id) == value
+            and discord_user_id not in self.latest
+        ):
+            return
+        self.latest[discord_user_id] = value
+        self.queue.put(discord_user_id, value)
+
+    async def _flush(self, items: dict[int, str]) -> None:
+        results = await wormgas.concurrency.fan_out(
+            [functools.partial(self.send, k, v) for k, v in items.items()]
+        )
+        for (discord_user_id, value), result in zip(
+            items.items(), results, strict=True
+        ):
+            if isinstance(result, Exception):
+                # A value put while this one was being sent replaces it
+                if (
+                    discord_user_id in self.queue.pending
+                    or discord_user_id in self.retries
+                    or self.latest.get(discord_user_id) != value
+                ):
+                    log.warning(
+                        f"Could not update {self.name} for {discord_user_id}, "
+                        f"a newer value is pending: {result!r}"
+                    )
+                    continue
+                failures = self.failures.get(discord_user_id, 0) + 1
+                self.failures[discord_user_id] = failures
+                backoff = min(self.min_backoff * 2 ** (failures - 1), self.max_backoff)
+                log.warning(
+                    f"Could not update {self.name} for {discord_user_id}, "
+                    f"retrying in {backoff}s: {result!r}"
+                )
+                self.retries[discord_user_id] = asyncio.create_task(
+                    self._retry(discord_user_id, value, backoff)
+                )
+            else:
+                log.info(f"Updated {self.name} for {discord_user_id}: {result}")
+                self.sent[discord_user_id] = value
+                self.failures.pop(discord_user_id, None)
+                if self.latest.get(discord_user_id) == value:
+                    del self.latest[discord_user_id]
+
+    async def _retry(self, discord_user_id: int, value: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        del self.retries[discord_user_id]
+        self.put(discord_user_id, value)
+
+    async def stop(self) -> None:
+        for retry in self.retries.values():
+            retry.cancel()
+        self.retries = {}
+        await self.queue.flush_now()
+
+
 class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
     def __init__(self, bot: wormgas.wormgas.Wormgas) -> None:
         self.bot = bot
@@ -79,29 +254,34 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
         self.not_tuned_in = (
             "You are not tuned in and you did not specify a valid channel code."
         )
+        self.stale_notice = " (Rainwave is not responding, this may be out of date.)"
+        self.unavailable = "Rainwave is not responding, try again later."
         codes = [code for code in RainwaveChannel.__members__.keys()]
         chan_code_ls = "**, **".join(codes)
         self.channel_codes = f"Channel codes are **{chan_code_ls}**."
+        self.api = wormgas.rainwave_client.RainwaveClient()
+        self.api_cache = wormgas.cache.AsyncCache()
+        self.schedule = ScheduleTracker(self.rw_info)
+        self.identities: dict[int, dict] = {}
+        self.identity_sid_ttl = 30
+        self.identity_user_id_ttl = 24 * 60 * 60
+        self.perks_synced: set[int] = set()
+        self.perk_updates = wormgas.concurrency.Debouncer(
+            self._flush_perk_updates, delay=10, max_wait=60
+        )
+        self.nickname_sync = ProfileSync("nickname", self.rw_update_nickname)
+        self.avatar_sync = ProfileSync("avatar", self.rw_update_avatar)
+        self.topic_channels: set[int] = set()
+        self.events_announced: set[int] = set()
+        self.topic_head: str | None = None
+        self.topic_pending: set[int] = set()
+        self.topic_edits: dict[int, collections.deque] = collections.defaultdict(
+            collections.deque
+        )
+        self.topic_edit_limit = 2
+        self.topic_edit_period = 10 * 60
         self.check_special_events.start()
 
-    async def _call(self, path: str, params: dict | None = None) -> dict:
-        log.debug(f"_call {path} {params}")
-        if params is None:
-            params = {}
-        base_url = "https://rainwave.cc/api4/"
-        url = base_url + path.lstrip("/")
-        headers = {"user-agent": str(uuid.uuid4())}
-        async with self.bot.session.post(
-            url, params=params, headers=headers
-        ) as response:
-            content = await response.text()
-            log.debug(f"{response.status} {content}")
-            if response.status == 200:
-                return await response.json()
-            log.critical(f"Response status for {url} is {response.status}")
-            log.critical(await response.text())
-        raise RuntimeError
-
     @staticmethod
     def artist_string(artists: list) -> str:
         return ", ".join([a.get("name") for a in artists])
@@ -140,134 +320,164 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
             "chan": await self.get_current_channel_for_user(user),
         }
 
-    async def get_current_channel_for_name(self, name: str) -> RainwaveChannel | None:
-        user_id = int(self.bot.db.config_get("rainwave:user_id"))
-        key = self.bot.db.config_get("rainwave:key")
-        d = await self.rw_user_search(user_id, key, name)
-        chan_id = d.get("user").get("sid")
-        if chan_id is None:
-            return None
-        return RainwaveChannel(int(chan_id))
-
     async def get_current_channel_for_user(
         self, user: discord.User
     ) -> RainwaveChannel | None:
-        user_info = await self.rw_user_search_by_discord_user_id(str(user.id))
-        user_sid = user_info.get("user", {}).get("sid")
-        if user_sid:
-            return RainwaveChannel(user_sid)
+        identity = await self.get_identity(user, self.identity_sid_ttl)
+        if identity["sid"]:
+            return RainwaveChannel(identity["sid"])
         if hasattr(user, "voice") and user.voice:
             vc_name = user.voice.channel.name
             if vc_name.lower() in RainwaveChannel.__members__.keys():
                 return RainwaveChannel[vc_name.lower()]
 
-    async def get_id_for_name(self, username: str) -> int:
-        rw_user_id = self.bot.db.config_get("rainwave:user_id")
-        key = self.bot.db.config_get("rainwave:key")
-        d = await self.rw_user_search(rw_user_id, key, username)
-        return d.get("user").get("user_id")
-
     async def get_id_for_user(self, user: discord.User) -> int:
-        user_id = str(user.id)
-        user_info = await self.rw_user_search_by_discord_user_id(user_id)
-        return user_info.get("user", {}).get("user_id")
+        identity = await self.get_identity(user, self.identity_user_id_ttl)
+        return identity["user_id"]
+
+    async def get_identity(self, user: discord.User, max_age: float) -> dict:
+        """Return the Rainwave user_id and current channel (sid) for a Discord user.
+
+        A cached result is reused if it is younger than max_age. Users who have not
+        linked their accounts are looked up again after identity_sid_ttl."""
+        identity = self.identities.get(user.id)
+        if identity is not None:
+            if identity["user_id"] is None:
+                max_age = min(max_age, self.identity_sid_ttl)
+            if time.monotonic() - identity["fetched_at"] < max_age:
+                return identity
+        user_info = await self.rw_user_search_by_discord_user_id(str(user.id))
+        identity = {
+            "user_id": user_info.get("user", {}).get("user_id"),
+            "sid": user_info.get("user", {}).get("sid"),
+            "fetched_at": time.monotonic(),
+        }
+        self.identities[user.id] = identity
+        return identity
 
     async def get_key_for_user(self, user: discord.User) -> str:
-        return self.bot.db.rw_api_keys_get(user.id)
+        return await self.bot.db.rw_api_keys_get(user.id)
+
+    async def get_user_for_name(self, username: str) -> dict:
+        user_id = await self.bot.db.config_get("rainwave:user_id")
+        key = await self.bot.db.config_get("rainwave:key")
+        d = await self.rw_user_search(user_id, key, username)
+        return d.get("user")
 
     async def rw_admin_list_producers_all(self, user_id: int, key: str) -> dict:
         params = {"user_id": user_id, "key": key}
-        return await self._call("admin/list_producers_all", params=params)
+        return await self._cached_call("admin/list_producers_all", params, 600)
 
     async def rw_clear_requests(self, user_id: int, key: str, sid: int) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid}
-        return await self._call("clear_requests", params=params)
+        return await self.api.call("clear_requests", params=params)
 
     async def rw_current_listeners(self, user_id: int, key: str, sid: int) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid}
-        return await self._call("current_listeners", params=params)
+        return await self._cached_call("current_listeners", params, 60)
+
+    async def _cached_call(
+        self,
+        path: str,
+        params: dict,
+        ttl: float | typing.Callable[[dict], float],
+    ) -> dict:
+        key = (path, tuple(sorted(params.items())))
+        try:
+            return await self.api_cache.get_or_fetch(
+                key, lambda: self.api.call(path, params=params), ttl
+            )
+        except Exception:
+            stale = self.api_cache.get_stale(key)
+            if stale is None:
+                raise
+            log.warning(f"Rainwave API call {path} failed, serving a stale response")
+            return {**stale, "stale": True}
+
+    @staticmethod
+    def info_ttl(d: dict) -> float:
+        # Cache schedule info until the current song is due to end
+        end = d.get("sched_current", {}).get("end")
+        if end is None:
+            return 10
+        return min(max(end - time.time(), 5), 300)
 
     async def rw_info(self, sid: int) -> dict:
         params = {"sid": sid}
-        return await self._call("info", params=params)
-
-    async def rw_info_all(self) -> dict:
-        params = {"sid": 1}
-        return await self._call("info_all", params=params)
+        return await self._cached_call("info", params, self.info_ttl)
 
     async def rw_listener(self, user_id: int, key: str, listener_id: int) -> dict:
         params = {"user_id": user_id, "key": key, "id": listener_id}
-        return await self._call("listener", params=params)
+        return await self.api.call("listener", params=params)
 
     async def rw_pause_request_queue(self, user_id: int, key: str, sid: int) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid}
-        return await self._call("pause_request_queue", params=params)
+        return await self.api.call("pause_request_queue", params=params)
 
     async def rw_request(self, user_id: int, key: str, sid: int, song_id: int) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid, "song_id": song_id}
-        return await self._call("request", params=params)
+        return await self.api.call("request", params=params)
 
     async def rw_request_favorited_songs(
         self, user_id: int, key: str, sid: int
     ) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid}
-        return await self._call("request_favorited_songs", params=params)
+        return await self.api.call("request_favorited_songs", params=params)
 
     async def rw_request_unrated_songs(self, user_id: int, key: str, sid: int) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid}
-        return await self._call("request_unrated_songs", params=params)
+        return await self.api.call("request_unrated_songs", params=params)
 
     async def rw_song(self, user_id: int, key: str, sid: int, song_id: int) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid, "id": song_id}
-        return await self._call("song", params=params)
+        return await self.api.call("song", params=params)
 
     async def rw_unpause_request_queue(self, user_id: int, key: str, sid: int) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid}
-        return await self._call("unpause_request_queue", params=params)
+        return await self.api.call("unpause_request_queue", params=params)
 
     async def rw_user_search(self, user_id: int, key: str, username: str) -> dict:
         params = {"user_id": user_id, "key": key, "username": username}
-        return await self._call("user_search", params=params)
+        return await self._cached_call("user_search", params, 30)
 
     async def rw_user_search_by_discord_user_id(self, discord_user_id: str) -> dict:
         params = {
             "discord_user_id": discord_user_id,
         }
-        return await self._call("user_search_by_discord_user_id", params=params)
+        return await self.api.call("user_search_by_discord_user_id", params=params)
 
     async def rw_vote(self, user_id: int, key: str, sid: int, entry_id: int) -> dict:
         params = {"user_id": user_id, "key": key, "sid": sid, "entry_id": entry_id}
-        return await self._call("vote", params=params)
+        return await self.api.call("vote", params=params)
 
     async def rw_update_nickname(self, discord_user_id: int, nickname: str) -> dict:
         params = {
             "discord_user_id": discord_user_id,
             "nickname": nickname,
         }
-        return await self._call("update_user_nickname_by_discord_id", params=params)
+        return await self.api.call("update_user_nickname_by_discord_id", params=params)
 
-    async def rw_update_avatar(
-        self, discord_user_id: int, avatar: discord.Asset
-    ) -> dict:
+    async def rw_update_avatar(self, discord_user_id: int, avatar_url: str) -> dict:
         params = {
             "discord_user_id": discord_user_id,
-            "avatar": avatar.url,
+            "avatar": avatar_url,
         }
-        return await self._call("update_user_avatar_by_discord_id", params=params)
+        return await self.api.call("update_user_avatar_by_discord_id", params=params)
 
-    async def rw_enable_perks(self, discord_users: list[discord.Member]) -> dict:
+    async def rw_enable_perks(self, discord_user_ids: list[int]) -> dict:
         params = {
-            "discord_user_ids": ",".join([str(u.id) for u in discord_users]),
+            "discord_user_ids": ",".join([str(i) for i in discord_user_ids]),
         }
-        return await self._call("enable_perks_by_discord_ids", params=params)
+        return await self.api.call("enable_perks_by_discord_ids", params=params)
 
     @staticmethod
-    def build_event_dict(chan: RainwaveChannel, info: dict) -> dict:
-        event_name = info["event_name"]
+    def build_event_dict(chan: RainwaveChannel, sched: dict) -> dict:
+        event_name = sched["name"]
         event = {
             "chan_id": chan.channel_id,
             "chan_url": chan.url,
             "chan_short_name": chan.short_name,
+            "id": sched.get("core_event_id") or sched.get("id"),
             "name": f"{event_name} Power Hour",
         }
         event["text"] = "[{chan_short_name}] {name} on now!".format(**event)
@@ -275,19 +485,18 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
 
     async def get_current_events(self) -> list:
         current_events = []
-        d = await self.rw_info_all()
-        for sid, info in d.get("all_stations_info", {}).items():
-            if info["event_type"] == "OneUp":
-                chan = RainwaveChannel(int(sid))
-                event = self.build_event_dict(chan, info)
+        for chan in RainwaveChannel:
+            sched = (await self.schedule.get(chan)).get("sched_current", {})
+            if sched.get("type") == "OneUp":
+                event = self.build_event_dict(chan, sched)
                 current_events.append(event)
         return current_events
 
     async def get_future_events(self) -> list:
         log.debug("get_future_events")
         future_events = []
-        user_id = self.bot.db.config_get("rainwave:user_id")
-        key = self.bot.db.config_get("rainwave:key")
+        user_id = await self.bot.db.config_get("rainwave:user_id")
+        key = await self.bot.db.config_get("rainwave:key")
         d = await self.rw_admin_list_producers_all(user_id=int(user_id), key=key)
         for p in d.get("producers", []):
             p_type = p["type"]
@@ -297,8 +506,7 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                 e_name = p["name"]
                 e_start = p["start"]
                 log.info(f"get_future_events: {e_name} will start at {e_start}")
-                tz_toronto = zoneinfo.ZoneInfo("America/Toronto")
-                when = datetime.datetime.fromtimestamp(e_start, tz_toronto)
+                when = datetime.datetime.fromtimestamp(e_start, TZ_TORONTO)
                 month = when.strftime("%b")
                 w_time = when.strftime("%H:%M")
                 e_text = (
@@ -311,16 +519,16 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
     async def ph_mention(self, channel: discord.TextChannel) -> None:
         utc = datetime.datetime.now(datetime.UTC)
 
-        current_time_eu = utc.astimezone(zoneinfo.ZoneInfo("Europe/Paris"))
+        current_time_eu = utc.astimezone(TZ_PARIS)
         if 8 <= current_time_eu.hour < 17:
-            role_id = self.bot.db.config_get("discord:roles:notify:🇪🇺")
+            role_id = await self.bot.db.config_get("discord:roles:notify:🇪🇺")
             if role_id:
                 log.info("Mentioning EU power hour notifications role")
                 await channel.send(f"<@&{role_id}>")
 
-        current_time_na = utc.astimezone(zoneinfo.ZoneInfo("America/Chicago"))
+        current_time_na = utc.astimezone(TZ_CHICAGO)
         if 8 <= current_time_na.hour < 17:
-            role_id = self.bot.db.config_get("discord:roles:notify:🎵")
+            role_id = await self.bot.db.config_get("discord:roles:notify:🎵")
             if role_id:
                 log.info("Mentioning NA power hour notifications role")
                 await channel.send(f"<@&{role_id}>")
@@ -328,36 +536,82 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
     @discord.ext.tasks.loop(minutes=1)
     async def check_special_events(self) -> None:
         await self.bot.wait_until_ready()
-        log.info("Checking for events ...")
+        log.debug("Checking for events ...")
         new_topic_head = "Welcome to Rainwave!"
-        event_now = False
-        events = await self.get_current_events()
-        future_events = await self.get_future_events()
+        try:
+            events = await self.get_current_events()
+            future_events = [] if events else await self.get_future_events()
+        except Exception:
+            log.exception("Could not check for events, skipping this check")
+            return
         if events:
-            log.info("There is an event on now")
-            event_now = True
             new_topic_head = " ".join([e["text"] for e in events])
         elif future_events:
-            log.info("There is an upcoming event")
             new_topic_head = future_events[0]
-            log.info(new_topic_head)
-        for channel_id in self.bot.db.topic_control_list():
-            log.info(f"Topic control is on for channel {channel_id}")
-            channel = self.bot.get_channel(channel_id)
-            channel_topic = channel.topic
-            if channel_topic is None:
-                channel_topic = ""
-            topic_parts = channel_topic.split(" | ")
-            if new_topic_head != topic_parts[0]:
-                log.info("I need to update the topic")
-                topic_parts[0] = new_topic_head
-                channel = await channel.edit(topic=" | ".join(topic_parts))
-                if event_now:
-                    log.info("I also need to announce an event")
-                    for e in events:
-                        m = "{text} {chan_url}".format(**e)
-                        await channel.send(m)
-                        await self.ph_mention(channel)
+        await self.announce_events(events)
+        if new_topic_head != self.topic_head:
+            log.info(f"New topic: {new_topic_head}")
+            self.topic_head = new_topic_head
+            self.topic_pending = set(self.topic_channels)
+        if not self.topic_pending:
+            return
+        channel_ids = sorted(self.topic_pending)
+        results = await wormgas.concurrency.fan_out(
+            [
+                functools.partial(self.update_topic, channel_id, new_topic_head)
+                for channel_id in channel_ids
+            ]
+        )
+        for channel_id, result in zip(channel_ids, results, strict=True):
+            if isinstance(result, Exception):
+                log.warning(f"Could not update topic for {channel_id}: {result!r}")
+            elif result:
+                self.topic_pending.discard(channel_id)
+
+    async def update_topic(self, channel_id: int, topic_head: str) -> bool:
+        """Replace the first part of a channel topic with topic_head. Return False if
+        the edit has to wait because of the Discord rate limit on topic edits."""
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            return True
+        topic_parts = (channel.topic or "").split(" | ")
+        if topic_parts[0] == topic_head:
+            return True
+        now = time.monotonic()
+        edits = self.topic_edits[channel_id]
+        while edits and now - edits[0] > self.topic_edit_period:
+            edits.popleft()
+        if len(edits) >= self.topic_edit_limit:
+            log.info(f"Deferring topic update for {channel_id} because of rate limits")
+            return False
+        edits.append(now)
+        log.info(f"Updating topic for {channel_id}")
+        topic_parts[0] = topic_head
+        await channel.edit(topic=" | ".join(topic_parts))
+        return True
+
+    async def announce_events(self, events: list) -> None:
+        """Announce each event in topic-controlled channels, once per event."""
+        for e in events:
+            if e["id"] is None or e["id"] in self.events_announced:
+                continue
+            log.info(f"Announcing event {e['id']}: {e['text']}")
+            self.events_announced.add(e["id"])
+            await self.bot.db.events_insert(e["id"])
+            await self.bot.db.events_update_notification_sent(e["id"])
+            channels = [self.bot.get_channel(i) for i in sorted(self.topic_channels)]
+            channels = [c for c in channels if c is not None]
+            results = await wormgas.concurrency.fan_out(
+                [functools.partial(self.announce_event, c, e) for c in channels]
+            )
+            for channel, result in zip(channels, results, strict=True):
+                if isinstance(result, Exception):
+                    log.warning(f"Could not announce event in {channel}: {result!r}")
+
+    async def announce_event(self, channel: discord.TextChannel, event: dict) -> None:
+        m = "{text} {chan_url}".format(**event)
+        await channel.send(m)
+        await self.ph_mention(channel)
 
     @discord.ext.commands.command()
     @discord.ext.commands.has_permissions(manage_channels=True)
@@ -366,13 +620,15 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
     ) -> None:
         """Turn automatic topic control on or off."""
         if isinstance(ctx.channel, discord.TextChannel):
-            topic_control_list = self.bot.db.topic_control_list()
-            if ctx.channel.id in topic_control_list:
-                self.bot.db.topic_control_delete(str(ctx.channel.id))
             if to_bool(on_off):
-                self.bot.db.topic_control_insert(str(ctx.channel.id))
+                await self.bot.db.topic_control_insert(ctx.channel.id)
+                self.topic_channels.add(ctx.channel.id)
+                self.topic_pending.add(ctx.channel.id)
                 await ctx.author.send(f"Topic control is ON for {ctx.channel.mention}")
             else:
+                await self.bot.db.topic_control_delete(ctx.channel.id)
+                self.topic_channels.discard(ctx.channel.id)
+                self.topic_pending.discard(ctx.channel.id)
                 await ctx.author.send(f"Topic control is OFF for {ctx.channel.mention}")
 
     @discord.ext.commands.group()
@@ -385,11 +641,8 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
     ) -> None:
         """Add your Rainwave key to your Discord account."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
-        self.bot.db.rw_api_keys_set(ctx.author.id, rainwave_key)
+        await self.bot.db.rw_api_keys_set(ctx.author.id, rainwave_key)
+        self.identities.pop(ctx.author.id, None)
         await ctx.author.send(
             f"I assigned the key {rainwave_key} to {ctx.author.mention}."
         )
@@ -398,22 +651,15 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
     async def key_drop(self, ctx: discord.ext.commands.Context) -> None:
         """Drop your Rainwave key from your Discord account."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
-        self.bot.db.rw_api_keys_delete(ctx.author.id)
+        await self.bot.db.rw_api_keys_delete(ctx.author.id)
+        self.identities.pop(ctx.author.id, None)
         await ctx.author.send(f"I dropped the key for {ctx.author.mention}")
 
     @key.command(name="show")
     async def key_show(self, ctx: discord.ext.commands.Context) -> None:
         """See the Rainwave key associated with your Discord account."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
-        rw_api_key = self.bot.db.rw_api_keys_get(ctx.author.id)
+        rw_api_key = await self.bot.db.rw_api_keys_get(ctx.author.id)
         if rw_api_key:
             await ctx.author.send(f"The key for {ctx.author.mention} is {rw_api_key}.")
         else:
@@ -423,16 +669,24 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
     async def lstats(self, ctx: discord.ext.commands.Context) -> None:
         """See information about current Rainwave radio listeners."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         m = "Registered listeners: "
         total = 0
-        user_id = self.bot.db.config_get("rainwave:user_id")
-        key = self.bot.db.config_get("rainwave:key")
-        for chan in RainwaveChannel:
-            d = await self.rw_current_listeners(user_id, key, chan.channel_id)
+        user_id = await self.bot.db.config_get("rainwave:user_id")
+        key = await self.bot.db.config_get("rainwave:key")
+        chans = list(RainwaveChannel)
+        results = await wormgas.concurrency.fan_out(
+            [
+                functools.partial(self.rw_current_listeners, user_id, key, c.channel_id)
+                for c in chans
+            ],
+            limit=len(chans),
+            timeout=5,
+        )
+        for chan, d in zip(chans, results, strict=True):
+            if isinstance(d, Exception):
+                log.warning(f"Could not get listeners for the {chan.long_name}: {d!r}")
+                m += f"{chan.long_name} = ?, "
+                continue
             count = len(d.get("current_listeners"))
             m += f"{chan.long_name} = {count}, "
             total += count
@@ -511,10 +765,6 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
         Short version is "!nx[<channel>]".
         Leave off <channel> to auto-detect the channel you are tuned to."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         cmd = ctx.invoked_with
         chan = None
         idx = 0
@@ -542,7 +792,11 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                 return
 
         m = f"Next up on the {chan.long_name}"
-        d = await self.rw_info(chan.channel_id)
+        try:
+            d = await self.schedule.get(chan)
+        except ScheduleUnavailableError:
+            await ctx.send(self.unavailable)
+            return
         event = d.get("sched_next")[idx]
         sched_id = int(event.get("id"))
         sched_type = event.get("type")
@@ -561,10 +815,12 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                 req = s.get("elec_request_username")
                 if req:
                     m += f" (requested by {req})"
+        if d.get("stale"):
+            m += self.stale_notice
 
         if ctx.guild:
-            config_id = f"rainwave:nx:{chan.channel_id}:{idx}"
-            if sched_id == (self.bot.db.config_get(config_id) or 0):
+            scope = f"rainwave:nx:{idx}"
+            if not self.bot.cooldowns.first_use(scope, chan.channel_id, sched_id):
                 c = (
                     f"You can only use **{cmd}** in "
                     f"{ctx.channel.mention} once per song."
@@ -572,7 +828,6 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                 await ctx.author.send(c)
                 await ctx.author.send(m)
             else:
-                self.bot.db.config_set(config_id, sched_id)
                 await ctx.send(m)
         else:
             await ctx.send(m)
@@ -589,10 +844,6 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
         Short version is "!np[<channel>]".
         Leave off <channel> to auto-detect the channel you are tuned to."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         async with ctx.typing():
             cmd = ctx.invoked_with
             chan = None
@@ -619,7 +870,11 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                     return
 
             m = f"Now playing on the {chan.long_name}"
-            d = await self.rw_info(chan.channel_id)
+            try:
+                d = await self.schedule.get(chan)
+            except ScheduleUnavailableError:
+                await ctx.send(self.unavailable)
+                return
             event = d.get("sched_current")
             sched_id = int(event.get("id"))
             sched_type = event.get("type")
@@ -631,13 +886,12 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
             song = event.get("songs")[0]
             embed = self.build_embed(song)
             m += f": {self.song_string(song)}"
+            if d.get("stale"):
+                m += self.stale_notice
 
             if ctx.guild:
-                config_last: str = (
-                    self.bot.db.config_get(f"rainwave:np:{chan.channel_id}") or "0"
-                )
-                last: int = int(config_last) or 0
-                if sched_id == last:
+                cooldowns = self.bot.cooldowns
+                if not cooldowns.first_use("rainwave:np", chan.channel_id, sched_id):
                     c = (
                         f"You can only use **{cmd}** in "
                         f"{ctx.channel.mention} once per song."
@@ -645,9 +899,6 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                     await ctx.author.send(c)
                     await ctx.author.send(m, embed=embed)
                 else:
-                    self.bot.db.config_set(
-                        f"rainwave:np:{chan.channel_id}", str(sched_id)
-                    )
                     await ctx.send(m, embed=embed)
             else:
                 await ctx.send(m, embed=embed)
@@ -667,10 +918,6 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
         <index> should be a number from 0 to 4 (default 0). The higher the number, the
         further back in time you go."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         async with ctx.typing():
             cmd = ctx.invoked_with
             if args is None:
@@ -719,7 +966,11 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                     return
 
             m = f"Previously on the {chan.long_name}"
-            d = await self.rw_info(chan.channel_id)
+            try:
+                d = await self.schedule.get(chan)
+            except ScheduleUnavailableError:
+                await ctx.send(self.unavailable)
+                return
             event = d.get("sched_history")[idx]
             sched_id = int(event.get("id"))
             sched_type = event.get("type")
@@ -731,18 +982,18 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
             song = event.get("songs")[0]
             embed = self.build_embed(song)
             m += f": {self.song_string(song)}"
+            if d.get("stale"):
+                m += self.stale_notice
 
             if ctx.guild:
-                config_key = f"rainwave:pp:{chan.channel_id}:{idx}"
-                last = self.bot.db.config_get(config_key) or 0
-                if sched_id == last:
+                scope = f"rainwave:pp:{idx}"
+                if not self.bot.cooldowns.first_use(scope, chan.channel_id, sched_id):
                     await ctx.author.send(
                         f"You can only use {cmd} in {ctx.channel.mention} "
                         f"once per song."
                     )
                     await ctx.author.send(m, embed=embed)
                 else:
-                    self.bot.db.config_set(config_key, sched_id)
                     await ctx.send(m, embed=embed)
             else:
                 await ctx.send(m, embed=embed)
@@ -760,10 +1011,6 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
         Use "!rq resume" to resume your request queue.
         Use "!rq clear" to remove all songs from your request queue."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         if args is None:
             args = ""
         tokens = args.split()
@@ -839,15 +1086,13 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
         Use "!ustats [<username>]" to see some statistics about a Rainwave user.
         Leave off <username> to see your own stats."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         async with ctx.typing():
             log.info(f"username: {username!r}")
 
             if username is None:
-                listener_id = await self.get_id_for_user(ctx.author)
+                identity = await self.get_identity(ctx.author, self.identity_sid_ttl)
+                listener_id = identity["user_id"]
+                sid = identity["sid"]
                 if listener_id is None:
                     await ctx.author.send(
                         "Use **!id add <id>** to connect your "
@@ -861,22 +1106,25 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
             ):
                 member = discord.utils.get(ctx.guild.members, id=int(username[2:-1]))
                 username = member.display_name
-                listener_id = await self.get_id_for_user(member)
+                identity = await self.get_identity(member, self.identity_sid_ttl)
+                listener_id = identity["user_id"]
+                sid = identity["sid"]
             else:
-                listener_id = await self.get_id_for_name(username)
+                rw_user = await self.get_user_for_name(username)
+                listener_id = rw_user.get("user_id")
+                sid = rw_user.get("sid")
 
             if listener_id is None:
                 await ctx.author.send(f"{username} is not a valid Rainwave user.")
                 return
 
-            user_id = self.bot.db.config_get("rainwave:user_id")
-            key = self.bot.db.config_get("rainwave:key")
+            user_id = await self.bot.db.config_get("rainwave:user_id")
+            key = await self.bot.db.config_get("rainwave:key")
             d = await self.rw_listener(user_id, key, listener_id)
             embed = self.build_embed_ustats(d.get("listener"))
 
-            user_name = d.get("listener").get("name")
-            current_channel = await self.get_current_channel_for_name(user_name)
-            if current_channel:
+            if sid:
+                current_channel = RainwaveChannel(int(sid))
                 embed.set_footer(
                     text=f"Currently listening to the {current_channel.long_name}"
                 )
@@ -885,15 +1133,12 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                 await ctx.send(embed=embed)
                 return
 
-            now = int(time.time())
-            last = int(self.bot.db.config_get("rainwave:ustats:last") or 0)
-            wait = int(self.bot.db.config_get("rainwave:ustats:wait") or 0)
-            if last < now - wait:
+            wait = int(await self.bot.db.config_get("rainwave:ustats:wait") or 0)
+            remaining = self.bot.cooldowns.acquire("rainwave:ustats", 0, wait)
+            if remaining == 0:
                 await ctx.send(embed=embed)
-                self.bot.db.config_set("rainwave:ustats:last", now)
             else:
                 await ctx.author.send(embed=embed)
-                remaining = last + wait - now
                 cmd = ctx.invoked_with
                 m = (
                     f"I am cooling down. You cannot use **{cmd}** in "
@@ -908,10 +1153,6 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
         Use "!vote <candidate>" to vote in the current election.
         Find the <candidate> (usually a number from 1 to 3) with "!next"."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         auth = await self.get_api_auth_for_user(ctx.author)
         if auth.get("user_id") is None:
             await ctx.author.send(self.nick_not_recognized)
@@ -924,7 +1165,11 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
             return
 
         chan = auth.get("chan")
-        d = await self.rw_info(chan.channel_id)
+        try:
+            d = await self.schedule.get(chan)
+        except ScheduleUnavailableError:
+            await ctx.author.send(self.unavailable)
+            return
         event = d.get("sched_next")[0]
         sched_type = event.get("type")
 
@@ -947,20 +1192,32 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
         else:
             await ctx.author.send("Your attempt to vote was not successful.")
 
+    @discord.ext.commands.command(name="rainwave-stats")
+    @discord.ext.commands.is_owner()
+    async def rainwave_stats(self, ctx: discord.ext.commands.Context) -> None:
+        """Show Rainwave API latency and cache statistics"""
+
+        lines = [f"{path}: {h}" for path, h in sorted(self.api.latency.items())]
+        lines.append(f"cache: {self.api_cache}")
+        lines.append(
+            f"profile sync: {self.nickname_sync.pending} nicknames, "
+            f"{self.avatar_sync.pending} avatars pending"
+        )
+        await ctx.author.send("\n".join(lines))
+
     @discord.ext.commands.Cog.listener()
     async def on_member_update(
         self, before: discord.Member, after: discord.Member
     ) -> None:
-        donor_role_id = self.bot.db.config_get("discord:roles:donor")
-        patron_role_id = self.bot.db.config_get("discord:roles:patron")
+        donor_role_id = await self.bot.db.config_get("discord:roles:donor")
+        patron_role_id = await self.bot.db.config_get("discord:roles:patron")
         if donor_role_id is not None and patron_role_id is not None:
             donor_role = before.guild.get_role(int(donor_role_id))
             patron_role = before.guild.get_role(int(patron_role_id))
             is_donor = donor_role in after.roles
             is_patron = patron_role in after.roles
-            if is_donor or is_patron:
-                log.info(f"Enabling perks for {after.display_name!r}")
-                log.info(await self.rw_enable_perks([after]))
+            if before.roles != after.roles and (is_donor or is_patron):
+                self.perk_updates.put(after.id, after)
                 if not is_donor:
                     await after.add_roles(donor_role)
         if before.display_name != after.display_name:
@@ -968,7 +1225,7 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                 f"{before.display_name!r} ({before.id}) "
                 f"changed display_name to {after.display_name!r}"
             )
-            await self.rw_update_nickname(after.id, after.display_name)
+            self.nickname_sync.put(after.id, after.display_name)
 
     @discord.ext.commands.Cog.listener()
     async def on_user_update(self, before: discord.User, after: discord.User) -> None:
@@ -977,40 +1234,87 @@ class RainwaveCog(discord.ext.commands.Cog, name="Rainwave"):
                 f"{after.display_name!r} ({after.id}) "
                 f"changed avatar to {after.display_avatar}"
             )
-            await self.rw_update_avatar(after.id, after.display_avatar)
+            self.avatar_sync.put(after.id, after.display_avatar.url)
 
-    async def _sync_donors(self, guild: discord.Guild) -> None:
-        donor_role_id = self.bot.db.config_get("discord:roles:donor")
-        patron_role_id = self.bot.db.config_get("discord:roles:patron")
+    @staticmethod
+    def perk_batches(
+        discord_user_ids: list[int], max_length: int = 1500
+    ) -> typing.Iterator[list[int]]:
+        """Split ids into batches that keep the request URL well under length limits"""
+        batch = []
+        length = 0
+        for discord_user_id in discord_user_ids:
+            id_length = len(str(discord_user_id)) + 1
+            if batch and length + id_length > max_length:
+                yield batch
+                batch = []
+                length = 0
+            batch.append(discord_user_id)
+            length += id_length
+        if batch:
+            yield batch
+
+    async def sync_perks(
+        self, members: typing.Iterable[discord.Member], full: bool = False
+    ) -> None:
+        """Enable Rainwave perks for members who have not been synced yet, or for all
+        of them if full is True."""
+        discord_user_ids = {m.id for m in members}
+        if not full:
+            discord_user_ids -= self.perks_synced
+        for batch in self.perk_batches(sorted(discord_user_ids)):
+            log.info(f"Enabling perks for {len(batch)} users")
+            log.info(await self.rw_enable_perks(batch))
+            self.perks_synced.update(batch)
+            await self.bot.db.perk_sync_insert_many(batch)
+
+    async def _flush_perk_updates(self, members: dict[int, discord.Member]) -> None:
+        await self.sync_perks(members.values())
+
+    async def _sync_donors(self, guild: discord.Guild, full: bool = False) -> None:
+        donor_role_id = await self.bot.db.config_get("discord:roles:donor")
+        patron_role_id = await self.bot.db.config_get("discord:roles:patron")
         if donor_role_id is not None and patron_role_id is not None:
             donor_role = guild.get_role(int(donor_role_id))
-            await self.rw_enable_perks(donor_role.members)
             patron_role = guild.get_role(int(patron_role_id))
-            for patron_member in patron_role.members:
-                if donor_role not in patron_member.roles:
-                    await patron_member.add_roles(donor_role)
+            await self.sync_perks(donor_role.members + patron_role.members, full)
+            missing = [m for m in patron_role.members if donor_role not in m.roles]
+            results = await wormgas.concurrency.fan_out(
+                [functools.partial(m.add_roles, donor_role) for m in missing], limit=5
+            )
+            for member, result in zip(missing, results, strict=True):
+                if isinstance(result, Exception):
+                    log.warning(f"Could not add donor role to {member}: {result!r}")
 
     @discord.ext.commands.command()
     @discord.ext.commands.is_owner()
     async def sync_donors(self, ctx: discord.ext.commands.Context) -> None:
         """Sync donor status between Rainwave and Discord"""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         for guild in self.bot.guilds:
-            await self._sync_donors(guild)
+            await self._sync_donors(guild, full=True)
 
     @discord.ext.commands.Cog.listener()
     async def on_ready(self) -> None:
-        if self.bot.db.config_get("rainwave:sync_donor_role_on_ready") == "1":
+        if await self.bot.db.config_get("rainwave:sync_donor_role_on_ready") == "1":
             for guild in self.bot.guilds:
                 log.info(f"Syncing donors for guild {guild.id}")
                 await self._sync_donors(guild)
 
+    async def cog_load(self) -> None:
+        self.perks_synced = await self.bot.db.perk_sync_list()
+        self.topic_channels = set(await self.bot.db.topic_control_list())
+        self.events_announced = await self.bot.db.events_list_notified()
+        await self.api.start()
+        self.schedule.start()
+
     async def cog_unload(self) -> None:
         self.check_special_events.cancel()
+        self.schedule.stop()
+        await self.perk_updates.flush_now()
+        await self.nickname_sync.stop()
+        await self.avatar_sync.stop()
+        await self.api.close()
 
 
 async def setup(bot: wormgas.wormgas.Wormgas) -> None:
@@ -1,8 +1,10 @@
+import asyncio
 import logging
 import secrets
 
 import discord.ext
 
+import wormgas.dice
 import wormgas.wormgas
 
 log = logging.getLogger(__name__)
@@ -52,10 +54,6 @@ class RandCog(discord.ext.commands.Cog, name="Randomness"):
     ) -> None:
         """Ask a question of the magic 8ball"""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         async with ctx.typing():
             embed = await self._eight_ball(ctx.author, question)
             await ctx.send(embed=embed)
@@ -70,49 +68,43 @@ class RandCog(discord.ext.commands.Cog, name="Randomness"):
     async def bang_flip(self, ctx: discord.ext.commands.Context) -> None:
         """Flip a coin"""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         async with ctx.typing():
             embed = await self._flip()
             await ctx.send(embed=embed)
 
     @staticmethod
-    async def _parse_die_spec(die_spec: str) -> tuple[int, int]:
-        dice = 1
-        sides = 6
-        dice_spec, _, sides_spec = die_spec.partition("d")
-        if dice_spec.isdigit():
-            dice = min(int(dice_spec), 100)
-        if sides_spec.isdigit():
-            sides = min(int(sides_spec), 10000)
-        return dice, sides
-
-    @staticmethod
-    async def _roll(dice: int, sides: int) -> str:
-        if sides == 0:
-            return "Who ever heard of a 0-sided :game_die:?"
-        rolls = [secrets.randbelow(sides - 1) + 1 for _ in range(dice)]
+    async def _roll(dice: wormgas.dice.Dice) -> str:
+        detailed = 1 < dice.count < 11
+        # Rolling a million dice takes a moment, so keep it off the event loop
+        r = await asyncio.to_thread(dice.roll, detailed)
         m = ":game_die:"
-        if 1 < dice < 11:
-            m = f"{m} [{', '.join(map(str, rolls))}] ="
-        m = f"{m} {sum(rolls)}"
+        if detailed:
+            rolls = [
+                str(v) if i in r.kept else f"~~{v}~~" for i, v in enumerate(r.values)
+            ]
+            m = f"{m} [{', '.join(rolls)}]"
+            if dice.modifier:
+                m = f"{m} {dice.modifier:+}"
+            m = f"{m} ="
+        m = f"{m} {r.total}"
         return m
 
     @discord.ext.commands.command(name="roll")
     async def bang_roll(
-        self, ctx: discord.ext.commands.Context, die_spec: str = "1d6"
+        self, ctx: discord.ext.commands.Context, *, die_spec: str = "1d6"
     ) -> None:
-        """Roll some dice"""
+        """Roll some dice
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
+        Examples: 3d6, 4d6k3 (keep the highest 3), 2d20kl1 (keep the lowest 1),
+        5d10! (exploding dice), 1d8+2"""
 
         async with ctx.typing():
-            dice, sides = await self._parse_die_spec(die_spec)
-            await ctx.send(await self._roll(dice, sides))
+            try:
+                dice = wormgas.dice.Dice.parse(die_spec)
+            except wormgas.dice.DiceError as err:
+                await ctx.send(f":game_die: {err}")
+                return
+            await ctx.send(await self._roll(dice))
 
 
 async def setup(bot: wormgas.wormgas.Wormgas) -> None:
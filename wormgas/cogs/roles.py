@@ -1,35 +1,176 @@
+import functools
+import logging
+import re
+import time
+
 import discord.ext
 
+import wormgas.concurrency
 import wormgas.wormgas
 
+log = logging.getLogger(__name__)
+
+SIGNUP_CHANNEL_KEY = "discord:channels:notification-signup"
+SIGNUP_MESSAGES_KEY = "discord:messages:notification-signup"
+NOTIFY_ROLES_PREFIX = "discord:roles:notify:"
+
+# discord:roles:notify:<message_id>:<emoji> links an emoji to a role on one message
+MESSAGE_EMOJI = re.compile(r"(\d+):(.+)")
+
 
 class RolesCog(discord.ext.commands.Cog):
     def __init__(self, bot: wormgas.wormgas.Wormgas) -> None:
         self.bot = bot
+        self.routes: dict[int, dict[str, int]] = {}
+
+    async def cog_load(self) -> None:
+        await self.load_routes()
+
+    async def load_routes(self) -> None:
+        """Build the {message_id: {emoji: role_id}} table from config"""
+        signup_messages = await self.bot.db.config_get(SIGNUP_MESSAGES_KEY) or ""
+        message_ids = []
+        for m in re.split(r"[\s,]+", signup_messages):
+            if m.isdecimal():
+                message_ids.append(int(m))
+            elif m:
+                log.warning(
+                    f"Ignoring invalid message id {m!r} in {SIGNUP_MESSAGES_KEY}"
+                )
+        shared: dict[str, int] = {}
+        per_message: dict[int, dict[str, int]] = {}
+        settings = await self.bot.db.config_list_prefix(NOTIFY_ROLES_PREFIX)
+        for key, role_id in settings.items():
+            if not role_id.isdecimal():
+                log.warning(f"Ignoring invalid role id {role_id!r} in {key}")
+                continue
+            emoji = key.removeprefix(NOTIFY_ROLES_PREFIX)
+            if match := MESSAGE_EMOJI.fullmatch(emoji):
+                message_id, emoji = match.groups()
+                per_message.setdefault(int(message_id), {})[emoji] = int(role_id)
+            else:
+                shared[emoji] = int(role_id)
+        routes = {message_id: dict(shared) for message_id in message_ids}
+        for message_id, emojis in per_message.items():
+            routes.setdefault(message_id, {}).update(emojis)
+        self.routes = routes
+        log.info(f"Loaded reaction roles for {len(routes)} messages")
+
+    @discord.ext.commands.Cog.listener()
+    async def on_config_change(self, key: str, value: str | None) -> None:
+        if key == SIGNUP_MESSAGES_KEY or key.startswith(NOTIFY_ROLES_PREFIX):
+            await self.load_routes()
 
     @discord.ext.commands.Cog.listener(name="on_raw_reaction_add")
     @discord.ext.commands.Cog.listener(name="on_raw_reaction_remove")
     async def _handle_reaction_change(
         self, payload: discord.RawReactionActionEvent
     ) -> None:
-        notification_signup_message_id = int(
-            self.bot.db.config_get("discord:messages:notification-signup")
-        )
-        if payload.message_id == notification_signup_message_id:
-            config_role_id = self.bot.db.config_get(
-                f"discord:roles:notify:{payload.emoji}"
+        routes = self.routes.get(payload.message_id)
+        if routes is None:
+            return
+        target_role_id = routes.get(str(payload.emoji))
+        if target_role_id is not None and payload.guild_id is not None:
+            guild = self.bot.get_guild(payload.guild_id)
+            member = guild.get_member(payload.user_id)
+            target_role = guild.get_role(target_role_id)
+            if payload.event_type == "REACTION_ADD":
+                await member.add_roles(target_role)
+                await member.send(f"I added you to the {target_role} role.")
+            elif payload.event_type == "REACTION_REMOVE":
+                await member.remove_roles(target_role)
+                await member.send(f"I removed you from the {target_role} role.")
+
+    async def reconcile(self) -> dict:
+        """Make role membership match the reactions on the signup messages.
+
+        Changes that happened while the bot was offline are never delivered as
+        reaction events, so this compares every routed role with the users who
+        reacted with its emoji and adds or removes the role as needed."""
+        start = time.monotonic()
+        result = {"added": 0, "removed": 0, "failed": 0}
+        channel_id = await self.bot.db.config_get(SIGNUP_CHANNEL_KEY)
+        if channel_id is None:
+            log.warning(
+                f"Cannot reconcile reaction roles, {SIGNUP_CHANNEL_KEY} is unset"
             )
-            if config_role_id:
-                target_role_id = int(config_role_id)
-                guild = self.bot.get_guild(payload.guild_id)
-                member = guild.get_member(payload.user_id)
-                target_role = guild.get_role(target_role_id)
-                if payload.event_type == "REACTION_ADD":
-                    await member.add_roles(target_role)
-                    await member.send(f"I added you to the {target_role} role.")
-                elif payload.event_type == "REACTION_REMOVE":
-                    await member.remove_roles(target_role)
-                    await member.send(f"I removed you from the {target_role} role.")
+            return {**result, "elapsed": time.monotonic() - start}
+        if not channel_id.isdecimal():
+            log.warning(
+                f"Cannot reconcile reaction roles, {SIGNUP_CHANNEL_KEY} is not a "
+                f"channel id: {channel_id!r}"
+            )
+            return {**result, "elapsed": time.monotonic() - start}
+        channel = self.bot.get_channel(int(channel_id))
+        if channel is None:
+            log.warning(
+                f"Cannot reconcile reaction roles, channel {channel_id} not found"
+            )
+            return {**result, "elapsed": time.monotonic() - start}
+        desired: dict[int, set[int]] = {}
+        # Roles linked to a message that could not be read are left alone
+        unknown: set[int] = set()
+        for message_id, routes in self.routes.items():
+            try:
+                message = await channel.fetch_message(message_id)
+            except discord.HTTPException as err:
+                log.warning(f"Could not fetch signup message {message_id}: {err!r}")
+                unknown.update(routes.values())
+                continue
+            for role_id in routes.values():
+                desired.setdefault(role_id, set())
+            for reaction in message.reactions:
+                role_id = routes.get(str(reaction.emoji))
+                if role_id is None:
+                    continue
+                # users() fetches reactions from Discord in pages of 100
+                async for user in reaction.users(limit=None):
+                    if not user.bot:
+                        desired[role_id].add(user.id)
+
+        changes = []
+        for role_id, user_ids in desired.items():
+            role = channel.guild.get_role(role_id)
+            if role is None or role_id in unknown:
+                continue
+            actual = {m.id for m in role.members}
+            for user_id in user_ids - actual:
+                member = channel.guild.get_member(user_id)
+                if member is not None:
+                    changes.append(("added", functools.partial(member.add_roles, role)))
+            changes.extend(
+                ("removed", functools.partial(m.remove_roles, role))
+                for m in role.members
+                if m.id not in user_ids
+            )
+        results = await wormgas.concurrency.fan_out(
+            [change for _, change in changes], limit=5
+        )
+        for (kind, _), r in zip(changes, results, strict=True):
+            if isinstance(r, Exception):
+                log.warning(f"Could not reconcile a reaction role: {r!r}")
+                result["failed"] += 1
+            else:
+                result[kind] += 1
+        result["elapsed"] = time.monotonic() - start
+        log.info(f"Reconciled reaction roles: {result}")
+        return result
+
+    @discord.ext.commands.Cog.listener()
+    async def on_ready(self) -> None:
+        if self.routes:
+            await self.reconcile()
+
+    @discord.ext.commands.command(name="reconcile-roles")
+    @discord.ext.commands.is_owner()
+    async def reconcile_roles(self, ctx: discord.ext.commands.Context) -> None:
+        """Sync reaction roles with the reactions on the signup messages"""
+
+        r = await self.reconcile()
+        await ctx.author.send(
+            f"Added {r['added']} and removed {r['removed']} roles "
+            f"({r['failed']} failed) in {r['elapsed']:.1f}s."
+        )
 
 
 async def setup(bot: wormgas.wormgas.Wormgas) -> None:
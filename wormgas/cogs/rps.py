@@ -20,8 +20,8 @@ class RpsCog(discord.ext.commands.Cog, name="Rock/Paper/Scissors"):
         }
 
     async def get_rps_record(self, player: discord.Member) -> str:
-        player_id = str(player.id)
-        player_dict = self.bot.db.rps_get(player_id)
+        player_id = player.id
+        player_dict = await self.bot.db.rps_get(player_id)
         if player_id is None:
             return f"{player.display_name} does not play. :("
 
@@ -38,8 +38,8 @@ class RpsCog(discord.ext.commands.Cog, name="Rock/Paper/Scissors"):
         )
 
     async def get_rps_stats(self, player: discord.Member) -> str:
-        player_id = str(player.id)
-        player_dict = self.bot.db.rps_get(player_id)
+        player_id = player.id
+        player_dict = await self.bot.db.rps_get(player_id)
         if player_id is None:
             return f"{player.display_name} does not play. :("
 
@@ -61,36 +61,27 @@ class RpsCog(discord.ext.commands.Cog, name="Rock/Paper/Scissors"):
         return m
 
     async def play_game(self, challenger: discord.User, action: str) -> str:
-        challenger_id = str(challenger.id)
+        challenger_id = challenger.id
         action = self.canonical_actions[action]
         action_map = ["rock", "paper", "scissors"]
         challenge = action_map.index(action)
         response = secrets.randbelow(3)
-        player_dict = self.bot.db.rps_get(challenger_id)
-        global_dict = self.bot.db.rps_get("!global")
-        player_dict[action] = player_dict.get(action, 0) + 1
-        global_dict[action] = global_dict.get(action, 0) + 1
-
         m = (
             f"You challenge with **{action}**. "
             f"I counter with **{action_map[response]}**."
         )
 
         if challenge == (response + 1) % 3:
-            player_dict["wins"] = player_dict.get("wins", 0) + 1
-            global_dict["wins"] = global_dict.get("wins", 0) + 1
+            outcome = "wins"
             m = m + " You win!"
         elif challenge == response:
-            player_dict["draws"] = player_dict.get("draws", 0) + 1
-            global_dict["draws"] = global_dict.get("draws", 0) + 1
+            outcome = "draws"
             m = m + " We draw!"
-        elif challenge == (response + 2) % 3:
-            player_dict["losses"] = player_dict.get("losses", 0) + 1
-            global_dict["losses"] = global_dict.get("losses", 0) + 1
+        else:
+            outcome = "losses"
             m = m + " You lose!"
 
-        self.bot.db.rps_set(player_dict)
-        self.bot.db.rps_set(global_dict)
+        player_dict = await self.bot.db.rps_record_game(challenger_id, action, outcome)
 
         w = player_dict.get("wins", 0)
         d = player_dict.get("draws", 0)
@@ -104,10 +95,6 @@ class RpsCog(discord.ext.commands.Cog, name="Rock/Paper/Scissors"):
     async def rock(self, ctx: discord.ext.commands.Context) -> None:
         """Play a game of rock-paper-scissors."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         await ctx.send(await self.play_game(ctx.author, ctx.invoked_with))
 
     @discord.ext.commands.group(name="rps")
@@ -120,10 +107,6 @@ class RpsCog(discord.ext.commands.Cog, name="Rock/Paper/Scissors"):
     ) -> None:
         """Request the record for a rock-paper-scissors player."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         if player is None:
             player = ctx.author
         await ctx.send(await self.get_rps_record(player))
@@ -134,34 +117,62 @@ class RpsCog(discord.ext.commands.Cog, name="Rock/Paper/Scissors"):
     ) -> None:
         """Request statistics for a rock-paper-scissors player."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         if player is None:
             player = ctx.author
         await ctx.send(await self.get_rps_stats(player))
 
+    @rps.command()
+    async def top(self, ctx: discord.ext.commands.Context) -> None:
+        """Show the best rock-paper-scissors players."""
+
+        results = await self.bot.db.rps_top()
+        if not results:
+            await ctx.send("Nobody plays. :(")
+            return
+        lines = []
+        for i, r in enumerate(results, start=1):
+            user = self.bot.get_user(r["user_id"])
+            name = r["user_id"] if user is None else user.display_name
+            lines.append(
+                f"{i}. {name}: {r['wins']}-{r['draws']}-{r['losses']} "
+                f"(score {r['score']:.3f})"
+            )
+        embed = discord.Embed(title="RPS leaderboard", description="\n".join(lines))
+        await ctx.send(embed=embed)
+
+    @rps.command()
+    async def rank(
+        self, ctx: discord.ext.commands.Context, player: discord.Member = None
+    ) -> None:
+        """Request the leaderboard rank for a rock-paper-scissors player."""
+
+        if player is None:
+            player = ctx.author
+        r = await self.bot.db.rps_rank(player.id)
+        if r is None or r["games"] == 0:
+            await ctx.send(f"{player.display_name} does not play. :(")
+            return
+        await ctx.send(
+            f"{player.display_name} is ranked #{r['rank']} "
+            f"with a score of {r['score']:.3f}."
+        )
+
     @rps.command()
     async def reset(
         self, ctx: discord.ext.commands.Context, reset_code: str | None = None
     ) -> None:
         """Reset your record and delete your game history."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
-        player_dict = self.bot.db.rps_get(str(ctx.author.id))
+        player_dict = await self.bot.db.rps_get(ctx.author.id)
         if reset_code and reset_code == player_dict.get("reset_code"):
-            self.bot.db.rps_delete(str(ctx.author.id))
+            await self.bot.db.rps_delete(ctx.author.id)
             await ctx.author.send(
                 "I reset your RPS record and deleted your game history."
             )
         else:
             reset_code = f"{secrets.randbelow(1000000):06d}"
             player_dict["reset_code"] = reset_code
-            self.bot.db.rps_set(player_dict)
+            await self.bot.db.rps_set(player_dict)
             await ctx.author.send(
                 f"Use `!rps reset {reset_code}` to reset your RPS record "
                 f"and delete your history."
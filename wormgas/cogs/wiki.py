@@ -1,9 +1,11 @@
+import asyncio
 import logging
 import textwrap
 
 import discord.ext
-import wikipedia
 
+import wormgas.cache
+import wormgas.mediawiki_client
 import wormgas.wormgas
 
 log = logging.getLogger(__name__)
@@ -12,6 +14,36 @@ log = logging.getLogger(__name__)
 class WikiCog(discord.ext.commands.Cog, name="Wikipedia"):
     def __init__(self, bot: wormgas.wormgas.Wormgas) -> None:
         self.bot = bot
+        self.client = wormgas.mediawiki_client.MediaWikiClient(bot.session)
+        self.cache = wormgas.cache.AsyncCache(max_size=256)
+        self.timeout = 10
+        self.found_ttl = 24 * 60 * 60
+        self.not_found_ttl = 60 * 60
+
+    @staticmethod
+    def normalize(search_terms: str) -> str:
+        # MediaWiki titles are case-sensitive except for the first character
+        title = " ".join(search_terms.split())
+        return title[:1].upper() + title[1:]
+
+    async def lookup(self, search_terms: str) -> dict:
+        async with asyncio.timeout(self.timeout):
+            try:
+                d = await self.client.page_summary(search_terms)
+            except wormgas.mediawiki_client.PageNotFoundError:
+                return {"error": f'Page "{search_terms}" does not match any pages.'}
+            if d.get("type") == "disambiguation":
+                return {"options": await self.client.page_links(d["title"])}
+            return {
+                "title": d["title"],
+                "summary": d.get("extract", ""),
+                "url": d["content_urls"]["desktop"]["page"],
+            }
+
+    def result_ttl(self, result: dict) -> float:
+        if "title" in result:
+            return self.found_ttl
+        return self.not_found_ttl
 
     @discord.ext.commands.command()
     async def wiki(
@@ -19,27 +51,36 @@ class WikiCog(discord.ext.commands.Cog, name="Wikipedia"):
     ) -> None:
         """Look up information on Wikipedia."""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         try:
-            page = wikipedia.page(search_terms, auto_suggest=False)
-        except wikipedia.exceptions.DisambiguationError as err:
+            result = await self.cache.get_or_fetch(
+                self.normalize(search_terms),
+                lambda: self.lookup(search_terms),
+                self.result_ttl,
+            )
+        except TimeoutError:
+            await ctx.author.send("Wikipedia did not answer in time, try again later.")
+            return
+        except Exception:
+            log.exception(f"Could not look up {search_terms!r}")
+            await ctx.author.send("There was a problem.")
+            return
+
+        if "options" in result:
+            options = result["options"]
             await ctx.author.send("Your query returned a disambiguation page.")
-            if len(err.options) < 6:
-                opts_list = "; ".join(err.options)
+            if len(options) < 6:
+                opts_list = "; ".join(options)
                 await ctx.author.send(f"Options: {opts_list}")
             else:
-                opts_list = "; ".join(err.options[:6])
+                opts_list = "; ".join(options[:6])
                 await ctx.author.send(f"Some options: {opts_list} ...")
             return
-        except wikipedia.exceptions.PageError as err:
-            await ctx.author.send(str(err))
+        if "error" in result:
+            await ctx.author.send(result["error"])
             return
 
-        summary = textwrap.shorten(page.summary, width=300, placeholder=" ...")
-        await ctx.send(f"{page.title} // {summary} [ {page.url} ]")
+        summary = textwrap.shorten(result["summary"], width=300, placeholder=" ...")
+        await ctx.send(f"{result['title']} // {summary} [ {result['url']} ]")
 
 
 async def setup(bot: wormgas.wormgas.Wormgas) -> None:
@@ -1,47 +1,88 @@
 import logging
+import re
 
 import discord.ext
 
+import wormgas.cache
 import wormgas.wormgas
 
 log = logging.getLogger(__name__)
 
+# Answers to these queries change over time, so they are only cached briefly
+TIME_SENSITIVE = re.compile(
+    r"\b(now|current|currently|today|tonight|tomorrow|yesterday|time|date|day|"
+    r"weather|temperature|forecast|sunrise|sunset|moon|price|stock|exchange|rate|"
+    r"latest|live|score)s?\b"
+)
+
 
 class WolframAlphaCog(discord.ext.commands.Cog, name="Wolfram|Alpha"):
     def __init__(self, bot: wormgas.wormgas.Wormgas) -> None:
         self.bot = bot
+        self.api_key: str | None = None
+        self.cache = wormgas.cache.AsyncCache(max_size=512)
+        self.short_ttl = 60
+        self.long_ttl = 24 * 60 * 60
 
-    async def _wa(self, query: str) -> str:
-        api_key = self.bot.db.config_get("wolframalpha:key")
-        if api_key is None:
-            return "Wolfram|Alpha API key not configured, cannot use /wa"
+    async def cog_load(self) -> None:
+        self.api_key = await self.bot.db.config_get("wolframalpha:key")
+
+    @discord.ext.commands.Cog.listener()
+    async def on_config_change(self, key: str, value: str | None) -> None:
+        if key == "wolframalpha:key":
+            self.api_key = value
 
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.split()).casefold()
+
+    def query_ttl(self, query: str) -> float:
+        if TIME_SENSITIVE.search(query):
+            return self.short_ttl
+        return self.long_ttl
+
+    async def _fetch(self, query: str) -> str:
         log.info(f"Looking up {query!r}")
 
         url = "https://api.wolframalpha.com/v1/result"
         params = {
-            "appid": api_key,
+            "appid": self.api_key,
             "i": query,
         }
         async with self.bot.session.get(url, params=params) as response:
             content = await response.text()
             log.debug(f"{response.status} {content}")
             if response.status in (200, 501):
-                return await response.text()
-            else:
-                return "There was a problem."
+                return content
+            raise RuntimeError(f"Response status for {url} is {response.status}")
+
+    async def _wa(self, query: str) -> str:
+        if self.api_key is None:
+            return "Wolfram|Alpha API key not configured, cannot use /wa"
+
+        key = self.normalize(query)
+        try:
+            return await self.cache.get_or_fetch(
+                key, lambda: self._fetch(query), self.query_ttl(key)
+            )
+        except Exception:
+            log.exception(f"Could not look up {query!r}")
+            return "There was a problem."
 
     @discord.ext.commands.command(name="wa")
     async def bang_wa(self, ctx: discord.ext.commands.Context, *, query: str) -> None:
         """Send a query to Wolfram|Alpha"""
 
-        self.bot.db.command_log_insert(
-            ctx.author.id, ctx.command.qualified_name, ctx.message.content
-        )
-
         async with ctx.typing():
             await ctx.send(await self._wa(query))
 
+    @discord.ext.commands.command(name="wa-stats")
+    @discord.ext.commands.is_owner()
+    async def wa_stats(self, ctx: discord.ext.commands.Context) -> None:
+        """Show Wolfram|Alpha cache statistics"""
+
+        await ctx.author.send(f"cache: {self.cache}")
+
 
 async def setup(bot: wormgas.wormgas.Wormgas) -> None:
     await bot.add_cog(WolframAlphaCog(bot))
@@ -0,0 +1,48 @@
+import datetime
+import logging
+
+import discord.ext.tasks
+
+from wormgas.models import Database
+
+log = logging.getLogger(__name__)
+
+
+class CommandLogWriter:
+    """Buffer command_log rows in memory and write them in batches.
+
+    Rows are flushed every few seconds, as soon as max_rows are waiting, and when
+    the bot shuts down."""
+
+    def __init__(self, db: Database, max_rows: int = 50) -> None:
+        self.db = db
+        self.max_rows = max_rows
+        self.pending: list[dict] = []
+
+    async def append(self, discord_user_id: int, command: str, message: str) -> None:
+        self.pending.append(
+            {
+                "occurred_at": datetime.datetime.now(tz=datetime.UTC).isoformat(),
+                "discord_user_id": discord_user_id,
+                "command": command,
+                "message": message,
+            }
+        )
+        if len(self.pending) >= self.max_rows:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self.pending:
+            return
+        records, self.pending = self.pending, []
+        log.debug(f"Writing {len(records)} command_log rows")
+        try:
+            await self.db.command_log_insert_many(records)
+        except Exception:
+            # Keep the rows and try again on the next flush
+            log.exception(f"Could not write {len(records)} command_log rows")
+            self.pending[:0] = records
+
+    @discord.ext.tasks.loop(seconds=5)
+    async def flush_periodically(self) -> None:
+        await self.flush()
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import math
+import typing
+
+log = logging.getLogger(__name__)
+
+
+async def fan_out[T](
+    calls: typing.Iterable[typing.Callable[[], typing.Awaitable[T]]],
+    limit: int = 4,
+    timeout: float | None = None,
+) -> list[T | Exception]:
+    """Run calls concurrently, at most limit at a time, each with its own timeout.
+
+    Results are returned in the same order as calls. A call that fails or times out
+    contributes its exception instead of a result, so the caller can still use the
+    results that did arrive."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(call: typing.Callable[[], typing.Awaitable[T]]) -> T:
+        async with semaphore, asyncio.timeout(timeout):
+            return await call()
+
+    return await asyncio.gather(*[run(call) for call in calls], return_exceptions=True)
+
+
+class Debouncer[K, V]:
+    """Collect values by key and pass them to flush() in one batch.
+
+    The batch is flushed once no new value has arrived for delay seconds, or
+    max_wait seconds after the first value in the batch, whichever comes first. A
+    newer value for a key replaces the older one."""
+
+    def __init__(
+        self,
+        flush: typing.Callable[[dict[K, V]], typing.Awaitable[None]],
+        delay: float,
+        max_wait: float | None = None,
+    ) -> None:
+        self.flush = flush
+        self.delay = delay
+        self.max_wait = max_wait
+        self.pending: dict[K, V] = {}
+        self.deadline = 0.0
+        self.task: asyncio.Task | None = None
+
+    def put(self, key: K, value: V) -> None:
+        loop = asyncio.get_running_loop()
+        if not self.pending:
+            self.deadline = loop.time() + (self.max_wait or math.inf)
+        self.pending[key] = value
+        if self.task is not None:
+            self.task.cancel()
+        delay = min(self.delay, self.deadline - loop.time())
+        self.task = asyncio.create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self.task = None
+        await self.flush_now()
+
+    async def flush_now(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if not self.pending:
+            return
+        items, self.pending = self.pending, {}
+        try:
+            await self.flush(items)
+        except Exception:
+            log.exception(f"Could not flush {len(items)} debounced items")
@@ -0,0 +1,106 @@
+import json
+import logging
+import math
+import time
+
+import discord.ext.tasks
+
+from wormgas.models import Database
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, tokens: float, updated_at: float) -> None:
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+    def acquire(self, now: float, period: float, capacity: int) -> float:
+        """Take a token if one is available and return 0, otherwise return the number
+        of seconds until the next token is available.
+
+        A token is added every period seconds, up to capacity tokens."""
+        if period <= 0:
+            return 0
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) / period)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) * period
+
+
+class Cooldowns:
+    """In-memory cooldown state keyed by (scope, channel_id).
+
+    The state is saved to the config table every few minutes and when the bot
+    shuts down, so cooldowns survive a restart without a database round-trip for
+    each command."""
+
+    config_key = "cooldowns:snapshot"
+
+    def __init__(self, db: Database) -> None:
+        self.db = db
+        self.buckets: dict[tuple[str, int], TokenBucket] = {}
+        self.last_seen: dict[tuple[str, int], int] = {}
+        self.dirty = False
+
+    def acquire(
+        self, scope: str, channel_id: int, period: float, capacity: int = 1
+    ) -> int:
+        """Use the cooldown for (scope, channel_id) and return 0, or return the number
+        of seconds remaining if it is cooling down."""
+        now = time.time()
+        bucket = self.buckets.setdefault(
+            (scope, channel_id), TokenBucket(capacity, now)
+        )
+        remaining = bucket.acquire(now, period, capacity)
+        if remaining == 0:
+            self.dirty = True
+        return math.ceil(remaining)
+
+    def first_use(self, scope: str, channel_id: int, value: int) -> bool:
+        """Return True if value differs from the last value seen for (scope,
+        channel_id), for things that may only happen once per song."""
+        if self.last_seen.get((scope, channel_id)) == value:
+            return False
+        self.last_seen[(scope, channel_id)] = value
+        self.dirty = True
+        return True
+
+    def snapshot(self) -> str:
+        return json.dumps(
+            {
+                "buckets": [
+                    [scope, channel_id, b.tokens, b.updated_at]
+                    for (scope, channel_id), b in self.buckets.items()
+                ],
+                "last_seen": [
+                    [scope, channel_id, value]
+                    for (scope, channel_id), value in self.last_seen.items()
+                ],
+            }
+        )
+
+    def restore(self, snapshot: str) -> None:
+        data = json.loads(snapshot)
+        for scope, channel_id, tokens, updated_at in data.get("buckets", []):
+            self.buckets[(scope, channel_id)] = TokenBucket(tokens, updated_at)
+        for scope, channel_id, value in data.get("last_seen", []):
+            self.last_seen[(scope, channel_id)] = value
+
+    async def load(self) -> None:
+        snapshot = await self.db.config_get(self.config_key)
+        if snapshot is not None:
+            self.restore(snapshot)
+
+    async def save(self) -> None:
+        if not self.dirty:
+            return
+        self.dirty = False
+        log.debug("Saving cooldown snapshot")
+        await self.db.config_set(self.config_key, self.snapshot())
+
+    @discord.ext.tasks.loop(minutes=5)
+    async def save_periodically(self) -> None:
+        await self.save()
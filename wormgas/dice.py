@@ -0,0 +1,180 @@
+import collections
+import functools
+import logging
+import re
+import secrets
+
+log = logging.getLogger(__name__)
+
+DICE_EXPRESSION = re.compile(
+    r"(?P<count>\d*)d(?P<sides>\d+)"
+    r"(?P<explode>!)?"
+    r"(?:k(?P<keep>[hl]?)(?P<keep_count>\d+))?"
+    r"(?P<explode_after>!)?"
+    r"(?P<modifier>[+-]\d+)?"
+)
+
+MAX_COUNT = 1_000_000
+MAX_SIDES = 1_000_000
+# Dice with more than 256 sides cannot be rolled in bulk from single bytes
+MAX_COUNT_LARGE_SIDES = 10_000
+# Keeping some of a set of exploding dice needs the value of every die
+MAX_COUNT_DETAILED = 10_000
+MAX_MODIFIER = 1_000_000
+MAX_EXPLOSION_ROUNDS = 100
+
+
+class DiceError(ValueError):
+    pass
+
+
+class Dice:
+    """A parsed dice expression like 3d6, 4d6k3, 2d20kl1, 5d10! or 1d8+2.
+
+    NdS rolls N dice with S sides. kN keeps the N highest dice and klN keeps the N
+    lowest. ! makes a die that shows its highest face roll again and add the new
+    roll. +M or -M adds a modifier to the total."""
+
+    def __init__(
+        self,
+        count: int = 1,
+        sides: int = 6,
+        keep: int | None = None,
+        keep_lowest: bool = False,
+        explode: bool = False,
+        modifier: int = 0,
+    ) -> None:
+        self.count = count
+        self.sides = sides
+        self.keep = keep
+        self.keep_lowest = keep_lowest
+        self.explode = explode
+        self.modifier = modifier
+
+    @classmethod
+    def parse(cls, expression: str) -> "Dice":
+        expression = expression.lower().replace(" ", "")
+        if expression.isdigit():
+            # A bare number is a number of six-sided dice
+            expression = f"{expression}d6"
+        match = DICE_EXPRESSION.fullmatch(expression)
+        if match is None:
+            raise DiceError(f"{expression!r} is not a dice expression")
+        dice = cls(
+            count=int(match["count"] or 1),
+            sides=int(match["sides"]),
+            keep_lowest=match["keep"] == "l",
+            explode=bool(match["explode"] or match["explode_after"]),
+            modifier=int(match["modifier"] or 0),
+        )
+        if match["keep_count"] is not None:
+            dice.keep = int(match["keep_count"])
+        dice.validate()
+        return dice
+
+    def validate(self) -> None:
+        if not 1 <= self.count <= MAX_COUNT:
+            raise DiceError(f"You can roll between 1 and {MAX_COUNT:,} dice")
+        if not 1 <= self.sides <= MAX_SIDES:
+            raise DiceError(f"Dice can have between 1 and {MAX_SIDES:,} sides")
+        if self.sides > 256 and self.count > MAX_COUNT_LARGE_SIDES:
+            raise DiceError(
+                f"You can roll up to {MAX_COUNT_LARGE_SIDES:,} dice with more than "
+                f"256 sides"
+            )
+        if self.keep is not None and not 1 <= self.keep <= self.count:
+            raise DiceError(f"You can keep between 1 and {self.count:,} dice")
+        if self.explode and self.sides == 1:
+            raise DiceError("A 1-sided die would explode forever")
+        if self.explode and self.keep is not None and self.count > MAX_COUNT_DETAILED:
+            raise DiceError(
+                f"You can keep some of up to {MAX_COUNT_DETAILED:,} exploding dice"
+            )
+        if abs(self.modifier) > MAX_MODIFIER:
+            raise DiceError(f"The modifier can be at most {MAX_MODIFIER:,}")
+
+    def roll(self, detailed: bool = False) -> "Roll":
+        """Roll the dice. Individual dice are only kept if detailed is True or if
+        they are needed to work out the total."""
+        if detailed or (self.explode and self.keep is not None):
+            return self._roll_detailed()
+        counts = face_counts(self.count, self.sides)
+        total = 0
+        if self.explode:
+            # An exploded die only adds to the total, so its extra rolls do not need
+            # to be matched up with the die that exploded
+            exploding = counts.get(self.sides, 0)
+            for _ in range(MAX_EXPLOSION_ROUNDS):
+                if not exploding:
+                    break
+                extra = face_counts(exploding, self.sides)
+                total += sum(face * n for face, n in extra.items())
+                exploding = extra.get(self.sides, 0)
+        if self.keep is None:
+            total += sum(face * n for face, n in counts.items())
+        else:
+            remaining = self.keep
+            for face in sorted(counts, reverse=not self.keep_lowest):
+                taken = min(counts[face], remaining)
+                total += face * taken
+                remaining -= taken
+                if remaining == 0:
+                    break
+        return Roll(self, total + self.modifier)
+
+    def _roll_detailed(self) -> "Roll":
+        values = [secrets.randbelow(self.sides) + 1 for _ in range(self.count)]
+        if self.explode:
+            for i, value in enumerate(values):
+                last = value
+                for _ in range(MAX_EXPLOSION_ROUNDS):
+                    if last != self.sides:
+                        break
+                    last = secrets.randbelow(self.sides) + 1
+                    values[i] += last
+        kept = list(range(self.count))
+        if self.keep is not None:
+            kept.sort(key=values.__getitem__, reverse=not self.keep_lowest)
+            kept = sorted(kept[: self.keep])
+        total = sum(values[i] for i in kept) + self.modifier
+        return Roll(self, total, values, set(kept))
+
+
+class Roll:
+    def __init__(
+        self,
+        dice: Dice,
+        total: int,
+        values: list[int] | None = None,
+        kept: set[int] | None = None,
+    ) -> None:
+        self.dice = dice
+        self.total = total
+        self.values = values
+        self.kept = kept
+
+
+@functools.cache
+def _byte_tables(sides: int) -> tuple[bytes, bytes]:
+    # Bytes at or above limit are rejected so that every face is equally likely
+    limit = 256 - 256 % sides
+    rejected = bytes(range(limit, 256))
+    faces = bytes(b % sides for b in range(256))
+    return rejected, faces
+
+
+def face_counts(count: int, sides: int) -> dict[int, int]:
+    """Roll count dice with the given number of sides and return how many dice
+    show each face"""
+    if sides > 256:
+        return collections.Counter(secrets.randbelow(sides) + 1 for _ in range(count))
+    rejected, faces = _byte_tables(sides)
+    accept_rate = (256 - len(rejected)) / 256
+    rolls = b""
+    while len(rolls) < count:
+        needed = count - len(rolls)
+        chunk = secrets.token_bytes(int(needed / accept_rate * 1.05) + 16)
+        rolls += chunk.translate(None, rejected)
+    rolls = rolls[:count].translate(faces)
+    counts = {face + 1: rolls.count(face) for face in range(sides)}
+    return {face: n for face, n in counts.items() if n}
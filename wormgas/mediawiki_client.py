@@ -0,0 +1,57 @@
+import logging
+import urllib.parse
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+
+class PageNotFoundError(LookupError):
+    pass
+
+
+class MediaWikiClient:
+    """A small async client for the MediaWiki REST and action APIs"""
+
+    user_agent = "wormgas (+https://github.com/williamjacksn/wormgas)"
+
+    def __init__(
+        self, session: aiohttp.ClientSession, base_url: str = "https://en.wikipedia.org"
+    ) -> None:
+        self.session = session
+        self.base_url = base_url.rstrip("/")
+        self.requests = 0
+
+    async def _get(self, url: str, params: dict | None = None) -> dict:
+        self.requests += 1
+        headers = {"user-agent": self.user_agent}
+        async with self.session.get(url, params=params, headers=headers) as response:
+            if response.status == 404:
+                raise PageNotFoundError(url)
+            if response.status != 200:
+                raise RuntimeError(f"Response status for {url} is {response.status}")
+            return await response.json(content_type=None)
+
+    async def page_summary(self, title: str) -> dict:
+        """Return the title, extract, canonical URL and type of a page, following
+        redirects"""
+        path = urllib.parse.quote(title.replace(" ", "_"), safe="")
+        url = f"{self.base_url}/api/rest_v1/page/summary/{path}"
+        return await self._get(url, params={"redirect": "true"})
+
+    async def page_links(self, title: str, limit: int = 50) -> list[str]:
+        """Return the titles of articles linked from a page, for example the options
+        on a disambiguation page"""
+        params = {
+            "action": "query",
+            "prop": "links",
+            "titles": title,
+            "plnamespace": 0,
+            "pllimit": limit,
+            "redirects": 1,
+            "format": "json",
+            "formatversion": 2,
+        }
+        d = await self._get(f"{self.base_url}/w/api.php", params=params)
+        pages = d.get("query", {}).get("pages", [])
+        return [link["title"] for p in pages for link in p.get("links", [])]
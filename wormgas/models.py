@@ -1,11 +1,93 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
 import datetime
+import queue
+import threading
+import typing
 
 import fort
 
+# rps_stats row that holds the totals for all players
+RPS_GLOBAL_USER_ID = 0
+
 
 class Database(fort.SQLiteDatabase):
+    """All statements run on a dedicated thread that owns the SQLite connection.
+
+    Coroutines should use the async methods, which never block the event loop. The
+    synchronous methods inherited from fort.SQLiteDatabase may only be used on the
+    database thread, for example in a function passed to call(), run() or atx()."""
+
     _version: int = 0
 
+    def __init__(self, dsn: str) -> None:
+        self._jobs = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._work, name="database", daemon=True)
+        self._thread.start()
+        self.call(super().__init__, dsn)
+
+    def _work(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, fn, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+        self.cnx.close()
+
+    def submit(self, fn: typing.Callable, *args: object) -> concurrent.futures.Future:
+        """Queue fn(*args) to run on the database thread"""
+        future = concurrent.futures.Future()
+        self._jobs.put((future, fn, args))
+        return future
+
+    def call(self, fn: typing.Callable, *args: object) -> typing.Any:  # noqa: ANN401
+        """Run fn(*args) on the database thread and block until it finishes"""
+        return self.submit(fn, *args).result()
+
+    async def run(self, fn: typing.Callable, *args: object) -> typing.Any:  # noqa: ANN401
+        """Run fn(*args) on the database thread and await the result"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    async def ab(self, sql: str, params: list[dict]) -> None:
+        await self.run(self.b, sql, params)
+
+    async def aq(self, sql: str, params: dict | None = None) -> list[dict]:
+        return await self.run(self.q, sql, params)
+
+    async def aq_one(self, sql: str, params: dict | None = None) -> dict | None:
+        return await self.run(self.q_one, sql, params)
+
+    async def aq_val(self, sql: str, params: dict | None = None) -> typing.Any:  # noqa: ANN401
+        return await self.run(self.q_val, sql, params)
+
+    async def au(self, sql: str, params: dict | None = None) -> int:
+        return await self.run(self.u, sql, params)
+
+    async def atx(self, fn: typing.Callable, *args: object) -> typing.Any:  # noqa: ANN401
+        """Run fn(*args) on the database thread inside a single transaction
+
+        fn should use the synchronous methods (q, u, b, ...). Nothing else runs on
+        the connection until the transaction is committed or rolled back."""
+
+        def _transaction() -> typing.Any:  # noqa: ANN401
+            with self.transaction():
+                return fn(*args)
+
+        return await self.run(_transaction)
+
+    def close(self) -> None:
+        """Finish queued work, close the connection, and stop the database thread"""
+        self._jobs.put(None)
+        self._thread.join()
+
     @property
     def version(self) -> int:
         if self._version == 0:
@@ -37,9 +119,38 @@ class Database(fort.SQLiteDatabase):
         self.u(sql, params)
         self._version = version
 
-    def command_log_insert(
-        self, discord_user_id: int, command: str, message: str
-    ) -> None:
+    async def command_log_archive(self, cutoff: datetime.datetime) -> int:
+        """Move command_log rows older than cutoff into command_log_archive.
+
+        Usage counts are already rolled up into command_stats, so archiving does not
+        change the output of !command-stats."""
+        params = {
+            "cutoff": cutoff.isoformat(),
+        }
+
+        def _archive() -> int:
+            self.u(
+                """
+                    insert into command_log_archive (
+                        occurred_at, discord_user_id, command, message
+                    )
+                    select occurred_at, discord_user_id, command, message
+                    from command_log
+                    where occurred_at < :cutoff
+                """,
+                params,
+            )
+            return self.u(
+                """
+                    delete from command_log
+                    where occurred_at < :cutoff
+                """,
+                params,
+            )
+
+        return await self.atx(_archive)
+
+    async def command_log_insert_many(self, records: list[dict]) -> None:
         sql = """
             insert into command_log (
                 occurred_at, discord_user_id, command, message
@@ -47,25 +158,83 @@ class Database(fort.SQLiteDatabase):
                 :occurred_at, :discord_user_id, :command, :message
             )
         """
+        totals = collections.Counter(r["command"] for r in records)
+        hourly = collections.Counter(
+            (r["occurred_at"][:13], r["command"]) for r in records
+        )
+
+        def _insert() -> None:
+            self.b(sql, records)
+            self.b(
+                """
+                    insert into command_stats (command, usage_count)
+                    values (:command, :usage_count)
+                    on conflict (command) do update set
+                        usage_count = usage_count + excluded.usage_count
+                """,
+                [{"command": c, "usage_count": n} for c, n in totals.items()],
+            )
+            self.b(
+                """
+                    insert into command_stats_hourly (bucket, command, usage_count)
+                    values (:bucket, :command, :usage_count)
+                    on conflict (bucket, command) do update set
+                        usage_count = usage_count + excluded.usage_count
+                """,
+                [
+                    {"bucket": b, "command": c, "usage_count": n}
+                    for (b, c), n in hourly.items()
+                ],
+            )
+
+        await self.atx(_insert)
+
+    async def command_stats_daily(
+        self, command: str, since: datetime.datetime
+    ) -> list[dict]:
+        sql = """
+            select substr(bucket, 1, 10) day, sum(usage_count) usage_count
+            from command_stats_hourly
+            where bucket >= :since
+                and command = :command
+            group by day
+            order by day
+        """
         params = {
-            "occurred_at": datetime.datetime.now(tz=datetime.UTC).isoformat(),
-            "discord_user_id": discord_user_id,
             "command": command,
-            "message": message,
+            "since": since.isoformat()[:13],
         }
-        self.u(sql, params)
+        return await self.aq(sql, params)
 
-    def command_log_list(self) -> list:
-        sql = """
-            select command, count(*) usage_count
-            from command_log
-            group by command
-            order by usage_count desc
-            limit 5
-        """
-        return self.q(sql)
+    async def command_stats_list(
+        self, since: datetime.datetime | None = None, limit: int = 5
+    ) -> list[dict]:
+        if since is None:
+            sql = """
+                select command, usage_count
+                from command_stats
+                order by usage_count desc
+                limit :limit
+            """
+            params = {
+                "limit": limit,
+            }
+        else:
+            sql = """
+                select command, sum(usage_count) usage_count
+                from command_stats_hourly
+                where bucket >= :since
+                group by command
+                order by usage_count desc
+                limit :limit
+            """
+            params = {
+                "limit": limit,
+                "since": since.isoformat()[:13],
+            }
+        return await self.aq(sql, params)
 
-    def config_delete(self, key: str) -> None:
+    async def config_delete(self, key: str) -> None:
         sql = """
             delete from config
             where key = :key
@@ -73,26 +242,39 @@ class Database(fort.SQLiteDatabase):
         params = {
             "key": key,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def config_get(self, key: str) -> str:
+    async def config_get(self, key: str) -> str:
         sql = """
             select value from config where key = :key
         """
         params = {
             "key": key,
         }
-        return self.q_val(sql, params)
+        return await self.aq_val(sql, params)
 
-    def config_list_keys(self) -> list[str]:
+    async def config_list_keys(self) -> list[str]:
         sql = """
             select key
             from config
             order by key
         """
-        return [r["key"] for r in self.q(sql)]
+        return [r["key"] for r in await self.aq(sql)]
+
+    async def config_list_prefix(self, prefix: str) -> dict[str, str]:
+        """Return all config settings whose key starts with prefix"""
+        sql = """
+            select key, value
+            from config
+            where key >= :prefix and key < :end
+        """
+        params = {
+            "prefix": prefix,
+            "end": prefix[:-1] + chr(ord(prefix[-1]) + 1),
+        }
+        return {r["key"]: r["value"] for r in await self.aq(sql, params)}
 
-    def config_set(self, key: str, value: str) -> None:
+    async def config_set(self, key: str, value: str) -> None:
         sql = """
             insert into config (key, value) values (:key, :value)
             on conflict (key) do update set value = excluded.value
@@ -101,9 +283,9 @@ class Database(fort.SQLiteDatabase):
             "key": key,
             "value": value,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def events_get(self, rw_event_id: int) -> dict | None:
+    async def events_get(self, rw_event_id: int) -> dict | None:
         sql = """
             select rw_event_id, notification_sent
             from events
@@ -112,19 +294,28 @@ class Database(fort.SQLiteDatabase):
         params = {
             "rw_event_id": rw_event_id,
         }
-        return self.q_one(sql, params)
+        return await self.aq_one(sql, params)
 
-    def events_insert(self, rw_event_id: int) -> None:
+    async def events_insert(self, rw_event_id: int) -> None:
         sql = """
             insert into events (rw_event_id)
             values (:rw_event_id)
+            on conflict (rw_event_id) do nothing
         """
         params = {
             "rw_event_id": rw_event_id,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
+
+    async def events_list_notified(self) -> set[int]:
+        sql = """
+            select rw_event_id
+            from events
+            where notification_sent = 1
+        """
+        return {r["rw_event_id"] for r in await self.aq(sql)}
 
-    def events_update_notification_sent(self, rw_event_id: int) -> None:
+    async def events_update_notification_sent(self, rw_event_id: int) -> None:
         sql = """
             update events
             set notification_sent = 1
@@ -133,9 +324,12 @@ class Database(fort.SQLiteDatabase):
         params = {
             "rw_event_id": rw_event_id,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
     def migrate(self) -> None:
+        self.call(self._migrate)
+
+    def _migrate(self) -> None:
         self.log.info(f"Database schema version is {self.version}")
         if self.version < 1:
             self.log.info("Migrating to database schema version 1")
@@ -225,8 +419,175 @@ class Database(fort.SQLiteDatabase):
                 add column notification_sent integer not null default 0
             """)
             self.version = 9
+        if self.version < 10:
+            self.log.info("Migrating to database schema version 10")
+            self.u("""
+                create table command_stats (
+                    command text primary key,
+                    usage_count integer not null default 0
+                )
+            """)
+            self.u("""
+                insert into command_stats (command, usage_count)
+                select command, count(*)
+                from command_log
+                group by command
+            """)
+            self.u("""
+                create table command_stats_hourly (
+                    bucket text,
+                    command text,
+                    usage_count integer not null default 0,
+                    primary key (bucket, command)
+                )
+            """)
+            self.u("""
+                insert into command_stats_hourly (bucket, command, usage_count)
+                select substr(occurred_at, 1, 13), command, count(*)
+                from command_log
+                group by substr(occurred_at, 1, 13), command
+            """)
+            self.u("""
+                create table command_log_archive (
+                    occurred_at text,
+                    discord_user_id integer,
+                    command text,
+                    message text
+                )
+            """)
+            self.version = 10
+        if self.version < 11:
+            self.log.info("Migrating to database schema version 11")
+            with self.transaction():
+                self.u("""
+                    create index command_log_occurred_at
+                    on command_log (occurred_at)
+                """)
+                self.u("""
+                    create index command_stats_usage_count
+                    on command_stats (usage_count)
+                """)
+                self.u("""
+                    create index watch_words_channel_id
+                    on watch_words (channel_id, discord_user_id, watch_text)
+                """)
+                self.u("""
+                    create table topic_control_new (
+                        channel_id integer primary key
+                    )
+                """)
+                self.u("""
+                    insert or ignore into topic_control_new (channel_id)
+                    select cast(channel_id as integer)
+                    from topic_control
+                """)
+                self.u("drop table topic_control")
+                self.u("alter table topic_control_new rename to topic_control")
+                self.u("""
+                    create table rps_stats_new (
+                        user_id integer primary key,
+                        rock int default 0,
+                        paper int default 0,
+                        scissors int default 0,
+                        wins int default 0,
+                        draws int default 0,
+                        losses int default 0,
+                        reset_code text
+                    )
+                """)
+                self.u(
+                    """
+                        insert into rps_stats_new (
+                            user_id, rock, paper, scissors, wins, draws, losses,
+                            reset_code
+                        )
+                        select
+                            case
+                                when user_id = '!global' then :global_user_id
+                                else cast(user_id as integer)
+                            end,
+                            rock, paper, scissors, wins, draws, losses, reset_code
+                        from rps_stats
+                    """,
+                    {"global_user_id": RPS_GLOBAL_USER_ID},
+                )
+                self.u("drop table rps_stats")
+                self.u("alter table rps_stats_new rename to rps_stats")
+                self.u("""
+                    create table rw_api_keys_new (
+                        discord_user_id integer primary key,
+                        rw_api_key text
+                    )
+                """)
+                self.u("""
+                    insert into rw_api_keys_new (discord_user_id, rw_api_key)
+                    select cast(discord_user_id as integer), rw_api_key
+                    from rw_api_keys
+                """)
+                self.u("drop table rw_api_keys")
+                self.u("alter table rw_api_keys_new rename to rw_api_keys")
+                self.version = 11
+        if self.version < 12:
+            self.log.info("Migrating to database schema version 12")
+            # Cooldowns are kept in memory now
+            self.u("""
+                delete from config
+                where key like 'chat:last_time_respond:%'
+                    or key like 'rainwave:np:%'
+                    or key like 'rainwave:nx:%'
+                    or key like 'rainwave:pp:%'
+                    or key = 'rainwave:ustats:last'
+            """)
+            self.version = 12
+        if self.version < 13:
+            self.log.info("Migrating to database schema version 13")
+            self.u("""
+                create table perk_sync (
+                    discord_user_id integer primary key
+                )
+            """)
+            self.version = 13
+        if self.version < 14:
+            self.log.info("Migrating to database schema version 14")
+            # Win rate smoothed towards 50% so players with a few lucky games do not
+            # top the leaderboard
+            self.u("""
+                alter table rps_stats
+                add column score real generated always as (
+                    (wins + 0.5 * draws + 5.0) / (wins + draws + losses + 10.0)
+                ) virtual
+            """)
+            self.u("""
+                create index rps_stats_score on rps_stats (score desc, user_id)
+                where user_id != 0
+            """)
+            self.version = 14
+        if self.version < 15:
+            self.log.info("Migrating to database schema version 15")
+            # Asking for a reset code saves a row with no games, and its score of 0.5
+            # would rank above players with a losing record
+            self.u("drop index rps_stats_score")
+            self.u("""
+                create index rps_stats_score on rps_stats (score desc, user_id)
+                where user_id != 0 and wins + draws + losses > 0
+            """)
+            self.version = 15
 
-    def rps_delete(self, user_id: str) -> None:
+    async def perk_sync_insert_many(self, discord_user_ids: list[int]) -> None:
+        sql = """
+            insert into perk_sync (discord_user_id) values (:discord_user_id)
+            on conflict (discord_user_id) do nothing
+        """
+        await self.ab(sql, [{"discord_user_id": i} for i in discord_user_ids])
+
+    async def perk_sync_list(self) -> set[int]:
+        sql = """
+            select discord_user_id
+            from perk_sync
+        """
+        return {r["discord_user_id"] for r in await self.aq(sql)}
+
+    async def rps_delete(self, user_id: int) -> None:
         sql = """
             delete from rps_stats
             where user_id = :user_id
@@ -234,9 +595,9 @@ class Database(fort.SQLiteDatabase):
         params = {
             "user_id": user_id,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def rps_get(self, user_id: str) -> dict:
+    async def rps_get(self, user_id: int) -> dict:
         sql = """
             select user_id, rock, paper, scissors, wins, draws, losses, reset_code
             from rps_stats
@@ -245,7 +606,7 @@ class Database(fort.SQLiteDatabase):
         params = {
             "user_id": user_id,
         }
-        r = self.q_one(sql, params)
+        r = await self.aq_one(sql, params)
         if r:
             return {
                 "user_id": r["user_id"],
@@ -259,7 +620,78 @@ class Database(fort.SQLiteDatabase):
             }
         return {"user_id": user_id}
 
-    def rps_set(self, params: dict) -> None:
+    async def rps_rank(self, user_id: int) -> dict | None:
+        sql = """
+            select
+                s.score,
+                s.wins + s.draws + s.losses as games,
+                (
+                    select count(*) + 1
+                    from rps_stats r
+                    where r.user_id != 0 and r.wins + r.draws + r.losses > 0
+                    and r.score > s.score
+                ) as rank
+            from rps_stats s
+            where s.user_id = :user_id and s.user_id != 0
+            and s.wins + s.draws + s.losses > 0
+        """
+        params = {
+            "user_id": user_id,
+        }
+        r = await self.aq_one(sql, params)
+        if r:
+            return dict(r)
+        return None
+
+    async def rps_record_game(self, user_id: int, action: str, outcome: str) -> dict:
+        """Count one game for a player and for the global totals.
+
+        action is rock, paper or scissors and outcome is wins, draws or losses, from
+        the player's point of view. Return the player's updated record."""
+        sql = """
+            insert into rps_stats (
+                user_id, rock, paper, scissors, wins, draws, losses
+            ) values (
+                :user_id, :rock, :paper, :scissors, :wins, :draws, :losses
+            ) on conflict (user_id) do update set
+                rock = rock + excluded.rock, paper = paper + excluded.paper,
+                scissors = scissors + excluded.scissors, wins = wins + excluded.wins,
+                draws = draws + excluded.draws, losses = losses + excluded.losses
+            returning user_id, rock, paper, scissors, wins, draws, losses, reset_code
+        """
+        counts = {
+            "rock": 0,
+            "paper": 0,
+            "scissors": 0,
+            "wins": 0,
+            "draws": 0,
+            "losses": 0,
+        }
+        if action not in counts or outcome not in counts:
+            raise ValueError(f"Unknown RPS action or outcome: {action}, {outcome}")
+        counts[action] = 1
+        counts[outcome] = 1
+
+        def _record() -> dict:
+            self.q(sql, {**counts, "user_id": RPS_GLOBAL_USER_ID})
+            return dict(self.q(sql, {**counts, "user_id": user_id})[0])
+
+        return await self.atx(_record)
+
+    async def rps_top(self, limit: int = 10) -> list[dict]:
+        sql = """
+            select user_id, score, wins, draws, losses
+            from rps_stats
+            where user_id != 0 and wins + draws + losses > 0
+            order by score desc, user_id
+            limit :limit
+        """
+        params = {
+            "limit": limit,
+        }
+        return [dict(r) for r in await self.aq(sql, params)]
+
+    async def rps_set(self, params: dict) -> None:
         sql = """
             insert into rps_stats (
                 user_id, rock, paper, scissors, wins, draws, losses, reset_code
@@ -276,30 +708,30 @@ class Database(fort.SQLiteDatabase):
                 params[key] = 0
         if "reset_code" not in params:
             params["reset_code"] = None
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def rw_api_keys_delete(self, discord_user_id: int) -> None:
+    async def rw_api_keys_delete(self, discord_user_id: int) -> None:
         sql = """
             delete from rw_api_keys
             where discord_user_id = :discord_user_id
         """
         params = {
-            "discord_user_id": str(discord_user_id),
+            "discord_user_id": discord_user_id,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def rw_api_keys_get(self, discord_user_id: int) -> str:
+    async def rw_api_keys_get(self, discord_user_id: int) -> str:
         sql = """
             select rw_api_key
             from rw_api_keys
             where discord_user_id = :discord_user_id
         """
         params = {
-            "discord_user_id": str(discord_user_id),
+            "discord_user_id": discord_user_id,
         }
-        return self.q_val(sql, params)
+        return await self.aq_val(sql, params)
 
-    def rw_api_keys_set(self, discord_user_id: int, rw_api_key: str) -> None:
+    async def rw_api_keys_set(self, discord_user_id: int, rw_api_key: str) -> None:
         sql = """
             insert into rw_api_keys (
                 discord_user_id, rw_api_key
@@ -309,12 +741,12 @@ class Database(fort.SQLiteDatabase):
                 rw_api_key = excluded.rw_api_key
         """
         params = {
-            "discord_user_id": str(discord_user_id),
+            "discord_user_id": discord_user_id,
             "rw_api_key": rw_api_key,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def topic_control_delete(self, channel_id: str) -> None:
+    async def topic_control_delete(self, channel_id: int) -> None:
         sql = """
             delete from topic_control
             where channel_id = :channel_id
@@ -322,25 +754,26 @@ class Database(fort.SQLiteDatabase):
         params = {
             "channel_id": channel_id,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def topic_control_insert(self, channel_id: str) -> None:
+    async def topic_control_insert(self, channel_id: int) -> None:
         sql = """
             insert into topic_control (channel_id) values (:channel_id)
+            on conflict (channel_id) do nothing
         """
         params = {
             "channel_id": channel_id,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def topic_control_list(self) -> list[int]:
+    async def topic_control_list(self) -> list[int]:
         sql = """
-            select distinct channel_id
+            select channel_id
             from topic_control
         """
-        return [int(r["channel_id"]) for r in self.q(sql)]
+        return [r["channel_id"] for r in await self.aq(sql)]
 
-    def watch_words_insert(
+    async def watch_words_insert(
         self, channel_id: int, discord_user_id: int, watch_text: str
     ) -> None:
         sql = """
@@ -355,9 +788,9 @@ class Database(fort.SQLiteDatabase):
             "discord_user_id": discord_user_id,
             "watch_text": watch_text,
         }
-        self.u(sql, params)
+        await self.au(sql, params)
 
-    def watch_words_list(self, channel_id: int) -> list[dict]:
+    async def watch_words_list(self, channel_id: int) -> list[dict]:
         sql = """
             select channel_id, discord_user_id, watch_text
             from watch_words
@@ -367,7 +800,17 @@ class Database(fort.SQLiteDatabase):
         params = {
             "channel_id": channel_id,
         }
-        return self.q(sql, params)
+        return await self.aq(sql, params)
+
+    @contextlib.contextmanager
+    def transaction(self) -> typing.Iterator[None]:
+        self.u("begin")
+        try:
+            yield
+        except BaseException:
+            self.u("rollback")
+            raise
+        self.u("commit")
 
     def _table_exists(self, table_name: str) -> bool:
         sql = """
@@ -0,0 +1,75 @@
+import argparse
+import importlib
+import logging
+import pathlib
+import sys
+import tempfile
+import time
+import typing
+
+log = logging.getLogger(__name__)
+
+
+def timed(fn: typing.Callable, *args: object) -> tuple[typing.Any, float]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def profile_startup(database: str, brain_file: str) -> dict[str, float]:
+    """Measure the slow parts of starting the bot, without connecting to Discord.
+
+    Each extension is imported after the core bot modules, so its import time only
+    counts the modules it adds, like the per-package totals of -X importtime."""
+    timings = {}
+    core, timings["import wormgas.wormgas"] = timed(
+        importlib.import_module, "wormgas.wormgas"
+    )
+    for name in core.EXTENSIONS:
+        _, timings[f"import {name}"] = timed(importlib.import_module, name)
+
+    start = time.perf_counter()
+    db = importlib.import_module("wormgas.models").Database(database)
+    db.migrate()
+    timings["database migration"] = time.perf_counter() - start
+    db.close()
+
+    brain = importlib.import_module("wormgas.cogs.cobe.brain")
+    _, timings["brain open"] = timed(brain.Brain, brain_file)
+    return timings
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="run.py --profile-startup")
+    parser.add_argument(
+        "--database",
+        default=":memory:",
+        help="database to migrate, a new in-memory database by default",
+    )
+    parser.add_argument(
+        "--brain-file", help="brain to open, a new empty brain by default"
+    )
+    parser.add_argument(
+        "--startup-budget",
+        type=float,
+        help="exit with status 1 if startup takes longer than this many seconds",
+    )
+    args = parser.parse_args(argv)
+
+    if "wormgas.wormgas" in sys.modules:
+        log.warning("wormgas.wormgas is already imported, import times are not cold")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        brain_file = args.brain_file or str(pathlib.Path(tmp) / "brain.sqlite")
+        timings = profile_startup(args.database, brain_file)
+
+    total = sum(timings.values())
+    width = max(len(name) for name in timings)
+    for name, elapsed in timings.items():
+        print(f"{name:<{width}}  {elapsed * 1000:9.1f} ms")
+    print(f"{'total':<{width}}  {total * 1000:9.1f} ms")
+
+    if args.startup_budget is not None and total > args.startup_budget:
+        print(f"Startup took {total:.3f}s, over the budget of {args.startup_budget}s")
+        return 1
+    return 0
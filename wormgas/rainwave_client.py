@@ -0,0 +1,196 @@
+import asyncio
+import bisect
+import collections
+import json
+import logging
+import math
+import time
+
+import aiohttp
+
+try:
+    import orjson
+except ModuleNotFoundError:
+    orjson = None
+
+log = logging.getLogger(__name__)
+
+
+def loads(data: bytes) -> dict:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class LatencyHistogram:
+    bounds = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """Return the upper bound of the bucket that contains quantile q"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts, strict=True):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def __str__(self) -> str:
+        if self.count == 0:
+            return "no calls"
+        mean = self.total / self.count * 1000
+        p50 = self.quantile(0.5) * 1000
+        p95 = self.quantile(0.95) * 1000
+        return (
+            f"{self.count} calls, mean {mean:.0f} ms, p50 ≤{p50:g} ms, p95 ≤{p95:g} ms"
+        )
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """Fail fast after repeated failures.
+
+    After failure_threshold consecutive failures the circuit opens and calls fail
+    immediately. Once reset_timeout seconds have passed, one probe call is allowed
+    through (half-open). The circuit closes if it succeeds and opens again if it
+    fails."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.probing or time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == "open" or (state == "half-open" and self.probing):
+            raise CircuitOpenError("Rainwave API circuit is open")
+        if state == "half-open":
+            log.info("Probing Rainwave API")
+            self.probing = True
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            log.info("Rainwave API circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            log.warning(f"Rainwave API circuit open after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+
+class RainwaveClient:
+    """Client for the Rainwave API with its own connection pool.
+
+    Read-only endpoints are retried with exponential backoff when Rainwave responds
+    with a server error. Latency is recorded per endpoint."""
+
+    base_url = "https://rainwave.cc/api4/"
+    user_agent = "wormgas (+https://github.com/williamjacksn/wormgas)"
+    default_timeout = 10
+    retries = 2
+
+    def __init__(self) -> None:
+        self.session: aiohttp.ClientSession | None = None
+        self.breaker = CircuitBreaker()
+        self.latency: collections.defaultdict[str, LatencyHistogram] = (
+            collections.defaultdict(LatencyHistogram)
+        )
+        self.timeouts: dict[str, float] = {
+            "admin/list_producers_all": 15,
+            "current_listeners": 5,
+            "enable_perks_by_discord_ids": 30,
+            "info": 5,
+            "user_search": 5,
+            "user_search_by_discord_user_id": 5,
+        }
+        self.idempotent: set[str] = {
+            "admin/list_producers_all",
+            "current_listeners",
+            "info",
+            "listener",
+            "song",
+            "user_search",
+            "user_search_by_discord_user_id",
+        }
+
+    async def start(self) -> None:
+        connector = aiohttp.TCPConnector(
+            limit=20, limit_per_host=10, ttl_dns_cache=300, keepalive_timeout=60
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, headers={"user-agent": self.user_agent}
+        )
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+    async def call(self, path: str, params: dict | None = None) -> dict:
+        path = path.lstrip("/")
+        url = self.base_url + path
+        timeout = aiohttp.ClientTimeout(
+            total=self.timeouts.get(path, self.default_timeout)
+        )
+        retries = self.retries if path in self.idempotent else 0
+        self.breaker.before_call()
+        probe = self.breaker.probing
+        try:
+            for attempt in range(retries + 1):
+                start = time.monotonic()
+                try:
+                    async with self.session.post(
+                        url, params=params, timeout=timeout
+                    ) as response:
+                        body = await response.read()
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                finally:
+                    self.latency[path].observe(time.monotonic() - start)
+                log.debug(f"{path} {response.status} ({len(body)} bytes)")
+                if response.status == 200:
+                    self.breaker.record_success()
+                    return loads(body)
+                log.critical(f"Response status for {url} is {response.status}")
+                log.critical(body.decode(errors="replace"))
+                if response.status < 500:
+                    self.breaker.record_success()
+                    break
+                if attempt == retries:
+                    self.breaker.record_failure()
+                    break
+                await asyncio.sleep(0.5 * 2**attempt)
+        except BaseException:
+            # A cancelled probe records no result, so let the next call probe
+            if probe:
+                self.breaker.probing = False
+            raise
+        raise RuntimeError(f"Rainwave API call {path} failed")
@@ -1,36 +1,85 @@
+import asyncio
+import contextlib
 import logging
 import os
+import signal
+import time
 
 import aiohttp
 import discord.ext.commands
 
+from wormgas.command_log import CommandLogWriter
+from wormgas.cooldowns import Cooldowns
 from wormgas.models import Database
 
 log = logging.getLogger(__name__)
 
+EXTENSIONS = [
+    "wormgas.cogs.chat",
+    "wormgas.cogs.config",
+    "wormgas.cogs.rainwave",
+    "wormgas.cogs.rand",
+    "wormgas.cogs.roles",
+    "wormgas.cogs.rps",
+    "wormgas.cogs.wiki",
+    "wormgas.cogs.wolframalpha",
+]
+
 
 class Wormgas(discord.ext.commands.Bot):
     def __init__(self, command_prefix: str, **options) -> None:  # noqa: ANN003
         super().__init__(command_prefix, **options)
         self.db = Database(os.getenv("DATABASE", "/etc/wormgas/config.db"))
         self.session = None
+        self.command_log = CommandLogWriter(self.db)
+        self.cooldowns = Cooldowns(self.db)
+        self.before_invoke(self.log_command)
 
     async def setup_hook(self) -> None:
+        # systemd stops the bot with SIGTERM, which would otherwise skip close()
+        with contextlib.suppress(NotImplementedError):
+            self.loop.add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.create_task(self.close())
+            )
+        await self.cooldowns.load()
         self.session = aiohttp.ClientSession(
             loop=self.loop, timeout=aiohttp.ClientTimeout(total=10)
         )
-        extension_names = [
-            "wormgas.cogs.chat",
-            "wormgas.cogs.config",
-            "wormgas.cogs.rainwave",
-            "wormgas.cogs.rand",
-            "wormgas.cogs.roles",
-            "wormgas.cogs.rps",
-            "wormgas.cogs.wiki",
-            "wormgas.cogs.wolframalpha",
-        ]
-        for extension_name in extension_names:
-            await self.load_extension(extension_name)
+        # Extensions are imported one at a time, but their setup (database reads,
+        # opening connections, ...) runs concurrently
+        start = time.perf_counter()
+        await asyncio.gather(*(self._load_extension(n) for n in EXTENSIONS))
+        elapsed = time.perf_counter() - start
+        log.info(f"Loaded {len(EXTENSIONS)} extensions in {elapsed:.3f}s")
+        self.command_log.flush_periodically.start()
+        self.cooldowns.save_periodically.start()
+
+    async def _load_extension(self, name: str) -> None:
+        start = time.perf_counter()
+        await self.load_extension(name)
+        log.info(f"Loaded {name} in {time.perf_counter() - start:.3f}s")
+
+    async def close(self) -> None:
+        self.command_log.flush_periodically.cancel()
+        await self.command_log.flush()
+        self.cooldowns.save_periodically.cancel()
+        await self.cooldowns.save()
+        await super().close()
+        if self.session is not None:
+            await self.session.close()
+        self.db.close()
+
+    async def log_command(self, ctx: discord.ext.commands.Context) -> None:
+        if isinstance(ctx.command, discord.ext.commands.Group):
+            # Group hooks also run for each subcommand, which is logged instead
+            return
+        try:
+            await self.command_log.append(
+                ctx.author.id, ctx.command.qualified_name, ctx.message.content
+            )
+        except Exception:
+            # A failure to log a command should never stop it from running
+            log.exception(f"Could not log command {ctx.command.qualified_name}")
 
 
 def main() -> None:
@@ -40,5 +89,5 @@ def main() -> None:
     intents.message_content = True
     bot = Wormgas(command_prefix="!", pm_help=True, intents=intents)
     bot.db.migrate()
-    token = bot.db.config_get("discord:token")
+    token = asyncio.run(bot.db.config_get("discord:token"))
     bot.run(token, log_handler=None)